@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiofiles
+import aiohttp
+
+from job import Job
+from pixiv import Pixiv
+from stubserver import add_arguments
+
+# resource 只在类 Unix 系统上有，没有时读不到峰值内存。
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Benchmark:
+    """在本地桩服务器上离线测量各条指令的性能。
+
+    桩服务器（见 stubserver.py）在单独的进程里运行，不和下载程序抢事件循环。
+    每条指令测量端到端吞吐量、峰值内存（RSS）和首字节落盘时间，
+    还可以比较"每张图片新建会话"和"共享连接池+调度器"两种下载方式。
+    """
+    # 默认测量的指令，覆盖按 ID、画师、排行榜、标签搜索和预览尺寸几条路径。
+    commands = ['id 12345678', 'member 7 90', 'rank week 90', 'tag miku 90', 'tag landscape 90 size=medium']
+    # 采样内存的间隔（秒）。
+    sample_interval = 0.01
+
+    def __init__(self, server_args: list[str], mirror_args: list[list[str]] = ()):
+        """启动桩服务器，初始化测试环境。
+
+        :param server_args: 传给桩服务器的命令行参数。
+        :param mirror_args: 每个镜像桩服务器的命令行参数，追加在 server_args 后面；为空时不启动镜像。
+        """
+        # 下载文件、缓存和统计的临时目录。
+        self.workdir = tempfile.mkdtemp(prefix='pixiv-bench-')
+        Pixiv.output_dir = os.path.join(self.workdir, 'outputs')
+        Pixiv.temp_dir = os.path.join(self.workdir, 'temp')
+        Pixiv.cache_dir = os.path.join(self.workdir, 'cache')
+        Pixiv.metrics_path = os.path.join(self.workdir, 'metrics.jsonl')
+        # 桩服务器不需要限速。
+        Pixiv.host_rate = 100000
+        Pixiv.host_burst = 100000
+        Pixiv.api_rate = 100000
+        Pixiv.api_burst = 100000
+        # 桩服务器启动后在第一行打印根地址。镜像与主服务器的数据相同，只是延迟、带宽等可以不同。
+        self.servers = [subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubserver.py'),
+             *server_args, *args], stdout=subprocess.PIPE, text=True) for args in [[], *mirror_args]]
+        base_urls = [server.stdout.readline().strip() for server in self.servers]
+        self.base_url = base_urls[0]
+        Pixiv.api_url = f'{self.base_url}/pixiv'
+        Pixiv.api_mirrors = [f'{url}/pixiv' for url in base_urls[1:]]
+        Pixiv.image_mirrors = [f'{url}/img' for url in base_urls]
+        self.app = Pixiv()
+        self.loop = Pixiv._Pixiv__loop
+
+    @staticmethod
+    def get_rss() -> int:
+        """读取本进程的常驻内存。
+
+        :returns: 当前的常驻内存（字节）；读不到当前值时退而返回历史峰值，都读不到则返回 None。
+        """
+        try:
+            with open('/proc/self/statm') as fr:
+                return int(fr.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            pass
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS 上单位是字节，Linux 上是 KB。
+            return rss if sys.platform == 'darwin' else rss * 1024
+        return None
+
+    def __sample_memory(self, stop: threading.Event, peak: list):
+        """在后台线程里定时采样内存，记下峰值。
+
+        :param stop: 停止采样的信号。
+        :param peak: 一元列表，存放峰值（字节）。
+        """
+        while True:
+            rss = self.get_rss()
+            if rss is not None:
+                peak[0] = max(peak[0] or 0, rss)
+            if stop.wait(self.sample_interval):
+                break
+
+    def __read_summaries(self) -> list[dict]:
+        """读取已经导出的各任务统计。"""
+        if not os.path.exists(Pixiv.metrics_path):
+            return []
+        with open(Pixiv.metrics_path, encoding='utf-8') as fr:
+            return [json.loads(line) for line in fr]
+
+    def measure(self, command: str) -> dict:
+        """执行一条指令并测量它的性能。
+
+        :param command: 指令，格式与交互模式里输入的相同。
+
+        :returns: 测量结果，时间的单位是秒，大小的单位是字节。
+        """
+        count = len(self.__read_summaries())
+        hedged = Pixiv._api_pool.hedged + Pixiv._image_pool.hedged
+        stop = threading.Event()
+        peak = [None]
+        sampler = threading.Thread(target=self.__sample_memory, args=(stop, peak), daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        Pixiv._Pixiv__dispatch(command.split())
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+        print('')
+        summaries = self.__read_summaries()
+        summary = summaries[-1] if len(summaries) > count else None
+        images = summary['requests']['image'] if summary is not None else {'count': 0, 'errors': 0, 'bytes': 0}
+        api = summary['requests']['api'] if summary is not None else {'count': 0}
+        downloaded = images['count'] - images['errors']
+        return {
+            'command': command,
+            'elapsed': elapsed,
+            'images': downloaded,
+            'bytes': images['bytes'],
+            'images_per_second': downloaded / elapsed,
+            'bytes_per_second': images['bytes'] / elapsed,
+            'first_write': summary['first_write'] if summary is not None else None,
+            'peak_rss': peak[0],
+            'api_requests': api['count'],
+            'retries': summary['retries'] if summary is not None else 0,
+            'hedged': Pixiv._api_pool.hedged + Pixiv._image_pool.hedged - hedged
+        }
+
+    @staticmethod
+    def format(result: dict) -> str:
+        """把一条指令的测量结果排成一行。
+
+        :param result: measure 返回的字典。
+
+        :returns: 一行测量结果。
+        """
+        first_write = f'{result["first_write"]:.3f}s' if result['first_write'] is not None else '-'
+        peak_rss = f'{result["peak_rss"] / 1024 / 1024:.1f}MB' if result['peak_rss'] is not None else '-'
+        return (f'{result["command"]:<32} {result["images"]:>5}张 {result["bytes"] / 1024 / 1024:>8.1f}MB '
+                f'{result["images_per_second"]:>8.1f}张/秒 {result["bytes_per_second"] / 1024 / 1024:>7.2f}MB/s '
+                f'首字节落盘{first_write:>8} 峰值内存{peak_rss:>8} API{result["api_requests"]:>4}次 '
+                f'重试{result["retries"]:>3}次 对冲{result["hedged"]:>3}次 用时{result["elapsed"]:.2f}s')
+
+    @staticmethod
+    async def __download_unpooled(url: str, filepath: str):
+        """旧的下载方式：每张图片单独创建一个会话。"""
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers=Pixiv.headers) as response:
+                content = await response.read()
+                async with aiofiles.open(filepath, 'wb') as fw:
+                    await fw.write(content)
+
+    def __make_illusts(self, image_num: int) -> list[dict]:
+        """构造指向桩服务器的单P插画数据。
+
+        :param image_num: 插画数。
+
+        :returns: 插画字典列表。
+        """
+        return [{
+            'id': index,
+            'title': 'bench',
+            'visible': True,
+            'page_count': 1,
+            'meta_single_page': {
+                'original_image_url': f'{self.base_url}/img/img-original/img/2021/01/01/00/00/00/{index}_p0.jpg'
+            }
+        } for index in range(image_num)]
+
+    async def __compare(self, image_num: int, pooled: bool) -> float:
+        """下载全部测试图片。
+
+        :param image_num: 图片数量。
+        :param pooled: 是否使用共享连接池。
+
+        :returns: 每秒下载的图片数。
+        """
+        illusts = self.__make_illusts(image_num)
+        start = time.perf_counter()
+        if pooled:
+            # 每页30幅，逐页交给下载流水线。
+            async def batches():
+                for index in range(0, len(illusts), Pixiv.page_quantity):
+                    yield illusts[index:index + Pixiv.page_quantity]
+            await Pixiv._Pixiv__schedule(batches(), Job('benchmark', Pixiv._retry))
+        else:
+            await asyncio.gather(*[self.__download_unpooled(
+                illust['meta_single_page']['original_image_url'],
+                os.path.join(self.workdir, f'unpooled-{illust["id"]}.jpg'))
+                for illust in illusts])
+        elapsed = time.perf_counter() - start
+        print('')
+        return len(illusts) / elapsed
+
+    def run(self, commands: list[str], compare: int = None, output: str = None):
+        """依次测量各条指令，需要时再比较两种下载方式，最后清理环境。
+
+        :param commands: 要测量的指令列表。
+        :param compare: 比较两种下载方式时下载的图片数，为 None 时不比较。
+        :param output: 保存结果的 JSON 文件路径，为 None 时不保存。
+        """
+        try:
+            results = [self.measure(command) for command in commands]
+            for result in results:
+                print(self.format(result))
+            if compare is not None:
+                before = self.loop.run_until_complete(self.__compare(compare, pooled=False))
+                after = self.loop.run_until_complete(self.__compare(compare, pooled=True))
+                print(f'每张图片新建会话: {before:.1f} 张/秒')
+                print(f'共享连接池+调度器: {after:.1f} 张/秒')
+            if output is not None:
+                with open(output, 'w', encoding='utf-8') as fw:
+                    json.dump(results, fw, ensure_ascii=False, indent=2)
+        finally:
+            Pixiv._Pixiv__quit()
+            for server in self.servers:
+                server.terminate()
+                server.wait()
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def parse_args() -> tuple[argparse.Namespace, list[str]]:
+    """解析命令行参数。
+
+    :returns: 解析好的参数，以及要转交给桩服务器的参数。
+    """
+    parser = argparse.ArgumentParser(
+        description='离线性能测试：在本地桩服务器上执行指令，测量吞吐量、峰值内存和首字节落盘时间。')
+    add_arguments(parser)
+    parser.add_argument('--concurrency', type=int, metavar='N',
+                        help='固定同时下载的图片数，默认自动调整')
+    parser.add_argument('--max-bandwidth', type=int, metavar='KB',
+                        help='所有下载加起来的带宽上限（KB/秒），默认不限')
+    parser.add_argument('--mirror', action='append', default=[], metavar='ARGS',
+                        help='再启动一个镜像桩服务器，ARGS 是它额外的选项（用引号括起来），例如 "--latency 500"；可以指定多次')
+    parser.add_argument('--compare', type=int, metavar='N',
+                        help='另外比较"每张图片新建会话"和"共享连接池+调度器"下载 N 张图片的吞吐量')
+    parser.add_argument('--output', metavar='FILE', help='把测量结果保存为 JSON')
+    parser.add_argument('commands', nargs='*', metavar='command',
+                        help=f'要测量的指令，每条用引号括起来，默认为: {"; ".join(Benchmark.commands)}')
+    args = parser.parse_args()
+    server_args = ['--latency', str(args.latency), '--bandwidth', str(args.bandwidth),
+                   '--error-rate', str(args.error_rate), '--image-size', args.image_size,
+                   '--illusts', str(args.illusts), '--seed', str(args.seed)]
+    return args, server_args
+
+
+if __name__ == '__main__':
+    args, server_args = parse_args()
+    if args.concurrency is not None:
+        Pixiv.concurrency = args.concurrency
+        Pixiv.adaptive_concurrency = False
+    if args.max_bandwidth is not None:
+        Pixiv.max_bandwidth = args.max_bandwidth * 1024
+    Benchmark(server_args, [shlex.split(mirror) for mirror in args.mirror]).run(args.commands or Benchmark.commands, args.compare, args.output)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import time
+
+
+class ResponseCache:
+    """API 响应的磁盘缓存。
+
+    用 SQLite 按请求参数保存 JSON 响应，每条记录有各自的过期时间；
+    总大小超过上限时，淘汰最久没被访问的记录。
+    """
+
+    def __init__(self, path: str, max_size: int):
+        """打开（或创建）缓存数据库。
+
+        :param path: 数据库文件路径。
+        :param max_size: 缓存总字节数上限。
+        """
+        self.path = path
+        self.max_size = max_size
+        # 命中次数。
+        self.hits = 0
+        # 未命中次数。
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        # expires 为 NULL 表示永不过期。
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key      TEXT PRIMARY KEY,
+                value    TEXT NOT NULL,
+                expires  REAL,
+                accessed REAL NOT NULL,
+                size     INTEGER NOT NULL
+            )''')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._conn.commit()
+        self._size = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def make_key(url: str, params: dict) -> str:
+        """把请求规范化成缓存键。
+
+        参数按名字排序、值统一转成字符串，所以参数顺序和类型不影响命中。
+
+        :param url: 请求地址。
+        :param params: 查询字符串参数。
+
+        :returns: 缓存键。
+        """
+        normalized = sorted((str(k), str(v)) for k, v in params.items())
+        return json.dumps([url, normalized], ensure_ascii=False)
+
+    def get(self, key: str) -> dict:
+        """查询缓存。
+
+        :param key: 缓存键。
+
+        :returns: 缓存的 JSON 数据；没有或已过期则返回 None。
+        """
+        now = time.time()
+        row = self._conn.execute(
+            'SELECT value, expires, size FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        value, expires, size = row
+        # 已过期就删掉。
+        if expires is not None and expires <= now:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._conn.commit()
+            self._size -= size
+            self.misses += 1
+            return None
+        self._conn.execute(
+            'UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        self._conn.commit()
+        self.hits += 1
+        return json.loads(value)
+
+    def put(self, key: str, data: dict, ttl: float):
+        """写入缓存，超出大小上限时按 LRU 淘汰。
+
+        :param key: 缓存键。
+        :param data: JSON 数据。
+        :param ttl: 有效期（秒），None 表示永不过期。
+        """
+        now = time.time()
+        value = json.dumps(data, ensure_ascii=False)
+        size = len(value.encode())
+        # 单条就超过上限的不缓存。
+        if size > self.max_size:
+            return
+        old = self._conn.execute(
+            'SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if old is not None:
+            self._size -= old[0]
+        self._conn.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+            (key, value, None if ttl is None else now + ttl, now, size))
+        self._size += size
+        self.__evict()
+        self._conn.commit()
+
+    def __evict(self):
+        """淘汰最久没被访问的记录，直到总大小不超过上限。"""
+        while self._size > self.max_size:
+            rows = self._conn.execute(
+                'SELECT key, size FROM responses ORDER BY accessed LIMIT 64').fetchall()
+            for key, size in rows:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._size -= size
+                if self._size <= self.max_size:
+                    break
+
+    def clear(self):
+        """清空缓存和计数器。"""
+        self._conn.execute('DELETE FROM responses')
+        self._conn.commit()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        """缓存的统计数据：命中数、未命中数、记录数和总字节数。"""
+        entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'size': self._size
+        }
+
+    def close(self):
+        """关闭数据库。"""
+        self._conn.close()
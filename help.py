@@ -10,6 +10,20 @@ class Help:
     - rank      按<排行榜>下载
     - tag       按<标签+人气值>下载{Color.end}
 
+    另外还有:{Color.white}
+    - archive   归档一段日期里的排行榜
+    - follow    关注画师，只下载新作品
+    - promote   把预览图换成原图
+    - query     在搜索过的插画里查询
+    - cache     查看或清空请求缓存{Color.end}
+
+    每条下载指令后面都可以加上"size=尺寸"，只下载预览图，省流量:{Color.white}
+    - square    小方图
+    - medium    中图
+    - large     大图
+    - original  原图(默认){Color.end}
+    例如 >>> rank week 30 size=medium
+
     您可以输入:
     {Color.purple}>>> help [功能]{Color.end}
     来查看某一功能的具体使用说明。
@@ -25,6 +39,7 @@ class Help:
 
     help_id = f'''
     按ID查找插画并下载。
+    如果是动图，我会下载装着各帧的zip包，并解压到同名文件夹里。
 
     指令格式:
     {Color.purple}>>> id [插画ID]{Color.end}
@@ -36,6 +51,7 @@ class Help:
 
     help_member = f'''
     按ID查找画师，并下载画师最新的若干幅插画。
+    插画数量写"all"就是全部下载，rank、tag 也一样。
     我会在下载开始前告诉您这位画师的名字，以便确认TA是否是您要找的画师。
 
     指令格式:
@@ -44,6 +60,9 @@ class Help:
     例如您输入:
     >>> member 1980643 3
     就可以下载画师[1980643]的最新[3]幅插画。
+    再例如您输入:
+    >>> member 1980643 all
+    就可以下载画师[1980643]的全部插画。
     '''
 
     help_rank = f'''
@@ -71,6 +90,20 @@ class Help:
     就可以下载[周榜]前[10]幅插画。
     '''
 
+    help_archive = f'''
+    归档一段日期里每一天的排行榜，可以同时归档多种排行模式。
+    排行模式与 rank 相同，也可以直接写"week_original"这样的名字；不写就归档日榜。
+    如果您没有指定下载多少幅，我会默认为您下载每个排行榜前<30>幅插画。
+    同一幅插画连续几天上榜也只下载一次；往日的排行榜会一直缓存，重复归档不用再等网络。
+
+    指令格式:
+    {Color.purple}>>> archive [起始日期] [结束日期]{Color.end} {Color.gray}[排行模式(选填)] ... [插画数量(选填)]{Color.end}
+
+    例如您输入:
+    >>> archive 2021-10-01 2021-10-31 day original 50
+    就可以下载2021年10月每一天[日榜]和[原创作品榜]前[50]幅插画。
+    '''
+
     help_tag = f'''
     搜索带有指定标签的，人气高于指定值的，最新的若干幅插画。
     标签随便写多少个都可以哦，但能不能搜出结果就得看Pixiv的算法了。
@@ -85,6 +118,70 @@ class Help:
     再例如您输入:
     >>> tag VOCALOID miku 10 10000
     就可以下载同时带有[VOCALOID]和[miku]标签的前[10]幅插画，并且人气高于[10000]。
+
+    加上"--local"，就只在搜索过的插画里找，不用等网络，只有还没下载的图片才会去下载:
+    >>> tag --local miku 10 10000
+    '''
+
+    help_follow = f'''
+    关注画师，并下载TA们上次同步之后发布的新作品。
+    我会记住每位画师看过的最新作品，再次同步时碰到它就停下，不会重新翻一遍。
+    第一次同步的画师，我会下载TA最新的<30>幅插画。
+    如果不写画师ID，就同步所有关注的画师。
+
+    指令格式:
+    {Color.purple}>>> follow{Color.end} {Color.gray}[画师ID(选填)] ...{Color.end}
+
+    例如您输入:
+    >>> follow 1980643 212801
+    就可以关注画师[1980643]和[212801]，并下载TA们的新作品。
+    之后每次输入:
+    >>> follow
+    就可以同步所有关注的画师。
+    '''
+
+    help_promote = f'''
+    按ID把插画换成原图下载。
+    先用"size=medium"等只下载预览图挑选，再把看中的插画换成原图。
+    已经下载过原图的插画会直接跳过。
+
+    指令格式:
+    {Color.purple}>>> promote [插画ID] [插画ID(选填)] ...{Color.end}
+
+    例如您输入:
+    >>> rank week 30 size=medium
+    >>> promote 84026087 84026088
+    就可以先下载[周榜]前[30]幅插画的中图，再下载其中[84026087]和[84026088]的原图。
+    '''
+
+    help_query = f'''
+    在搜索过的插画里查询，不用等网络。
+    每次搜索时，插画的标题、标签、画师、收藏数等信息都会保存在本地，这里按收藏数从高到低列出符合条件的插画。
+    原图已经下载过的插画前面会标上"✓"。
+    最后1个参数是数字的话，就是最低收藏数；加上"member=画师ID"可以只看某位画师的插画。
+
+    指令格式:
+    {Color.purple}>>> query [标签] ...{Color.end} {Color.gray}[member=画师ID(选填)] [人气值(选填)]{Color.end}
+
+    例如您输入:
+    >>> query miku 10000
+    就可以列出本地带有[miku]标签、收藏数不低于[10000]的插画。
+    '''
+
+    help_cache = f'''
+    查看或清空请求缓存。
+    搜索时的请求结果会缓存在本地，重复搜索时直接使用缓存，不用再等网络。
+    往日的排行榜不会再变，会一直缓存；其他结果几分钟到一天后过期。
+
+    指令格式:
+    {Color.purple}>>> cache{Color.end} {Color.gray}[clear(选填)]{Color.end}
+
+    例如您输入:
+    >>> cache
+    就可以查看缓存的命中次数、命中率和占用空间。
+    再例如您输入:
+    >>> cache clear
+    就可以清空缓存。
     '''
 
 
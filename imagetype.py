@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+from urllib.parse import urlsplit
+
+
+class ImageType:
+    """判断图片的真实格式。
+
+    Pixiv 的原图可能是 JPEG、PNG 或 GIF，预览图都是 JPEG。
+    优先看文件开头的魔数，认不出来时再看链接的后缀，都不行才默认为 PNG。
+    """
+    # 文件开头的魔数和对应的扩展名。
+    signatures = (
+        (b'\xff\xd8\xff', '.jpg'),
+        (b'\x89PNG\r\n\x1a\n', '.png'),
+        (b'GIF87a', '.gif'),
+        (b'GIF89a', '.gif'),
+        (b'PK\x03\x04', '.zip')
+    )
+    # 判断格式需要读取的字节数。
+    head_size = 12
+    # 认得的扩展名，".jpeg" 统一写作 ".jpg"。
+    extensions = ('.jpg', '.png', '.gif', '.webp', '.zip')
+    # 都认不出来时的扩展名。
+    default = '.png'
+
+    @classmethod
+    def from_bytes(cls, head: bytes) -> str:
+        """根据文件开头的字节判断格式。
+
+        :param head: 文件开头的若干字节，至少需要 head_size 个才能认出所有格式。
+
+        :returns: 扩展名，认不出来则返回 None。
+        """
+        for signature, extension in cls.signatures:
+            if head.startswith(signature):
+                return extension
+        # WebP 的魔数中间隔着4字节的长度。
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return '.webp'
+        return None
+
+    @classmethod
+    def from_url(cls, url: str) -> str:
+        """根据链接的后缀判断格式。
+
+        :param url: 图片链接。
+
+        :returns: 扩展名，认不出来则返回默认的扩展名。
+        """
+        extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        if extension == '.jpeg':
+            extension = '.jpg'
+        return extension if extension in cls.extensions else cls.default
+
+    @classmethod
+    def from_file(cls, path: str) -> str:
+        """读取文件开头的几个字节判断格式，不读整个文件。
+
+        :param path: 文件路径。
+
+        :returns: 扩展名，认不出来则返回 None。
+        """
+        with open(path, 'rb') as fr:
+            return cls.from_bytes(fr.read(cls.head_size))
+
+    @staticmethod
+    def fix_path(path: str, extension: str) -> str:
+        """把路径的扩展名换成真实格式的扩展名。
+
+        :param path: 文件路径。
+        :param extension: 真实格式的扩展名，为 None 时不改。
+
+        :returns: 修正后的路径。
+        """
+        if extension is None:
+            return path
+        return os.path.splitext(path)[0] + extension
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+
+class Index:
+    """已下载图片的索引。
+
+    用 SQLite 记录每张下载完成的图片，主键是(插画 ID, 分P序号, 尺寸)，
+    所以插画改了标题、文件名随之变化时，也不会重复下载；同一张图的预览图和原图分别记录。
+    """
+
+    def __init__(self, path: str):
+        """打开（或创建）索引数据库。
+
+        :param path: 数据库文件路径。
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        # 每下载一张就提交一次，用 WAL 减少提交的开销。
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self.__migrate()
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                illust_id INTEGER NOT NULL,
+                page      INTEGER NOT NULL,
+                tier      TEXT    NOT NULL DEFAULT 'original',
+                path      TEXT    NOT NULL,
+                size      INTEGER NOT NULL,
+                hash      TEXT    NOT NULL,
+                PRIMARY KEY (illust_id, page, tier)
+            )''')
+        self._conn.commit()
+
+    def __migrate(self):
+        """把旧版没有尺寸列的索引升级为新结构，旧记录都算作原图。"""
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(images)')]
+        if len(columns) == 0 or 'tier' in columns:
+            return
+        self._conn.executescript('''
+            ALTER TABLE images RENAME TO images_old;
+            CREATE TABLE images (
+                illust_id INTEGER NOT NULL,
+                page      INTEGER NOT NULL,
+                tier      TEXT    NOT NULL DEFAULT 'original',
+                path      TEXT    NOT NULL,
+                size      INTEGER NOT NULL,
+                hash      TEXT    NOT NULL,
+                PRIMARY KEY (illust_id, page, tier)
+            );
+            INSERT INTO images (illust_id, page, path, size, hash)
+                SELECT illust_id, page, path, size, hash FROM images_old;
+            DROP TABLE images_old;
+        ''')
+
+    def lookup(self, illust_id: int, page: int, tier: str = 'original') -> tuple[str, int, str]:
+        """查询一张图片的下载记录。
+
+        :param illust_id: 插画 ID。
+        :param page: 分P序号，从0开始。
+        :param tier: 图片尺寸，默认为原图。
+
+        :returns: 存储路径、字节数、SHA-256 组成的元组；没有记录则返回 None。
+        """
+        return self._conn.execute(
+            'SELECT path, size, hash FROM images WHERE illust_id = ? AND page = ? AND tier = ?',
+            (int(illust_id), page, tier)).fetchone()
+
+    def add(self, illust_id: int, page: int, path: str, size: int, hash: str, tier: str = 'original'):
+        """登记一张下载完成的图片。
+
+        :param illust_id: 插画 ID。
+        :param page: 分P序号，从0开始。
+        :param path: 存储路径。
+        :param size: 字节数。
+        :param hash: 文件内容的 SHA-256。
+        :param tier: 图片尺寸，默认为原图。
+        """
+        self._conn.execute(
+            'INSERT OR REPLACE INTO images (illust_id, page, tier, path, size, hash) VALUES (?, ?, ?, ?, ?, ?)',
+            (int(illust_id), page, tier, path, size, hash))
+        self._conn.commit()
+
+    def rename(self, old: str, new: str):
+        """更新改了名的图片的存储路径。
+
+        :param old: 原来的存储路径。
+        :param new: 新的存储路径。
+        """
+        self._conn.execute(
+            'UPDATE images SET path = ? WHERE path = ?', (new, old))
+        self._conn.commit()
+
+    def close(self):
+        """关闭数据库。"""
+        self._conn.close()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from contextvars import ContextVar
+
+from metrics import Metrics
+from retry import RetryPolicy
+
+
+class Job:
+    """一条指令对应的下载任务。
+
+    每个任务有自己的进度、失败记录和重试预算，多个任务可以同时进行。
+    """
+
+    def __init__(self, name: str, retry: RetryPolicy, tier: str = 'original'):
+        """创建任务。
+
+        :param name: 任务名，即指令原文。
+        :param retry: 该任务专用的重试策略。
+        :param tier: 下载的图片尺寸，默认为原图。
+        """
+        self.name = name
+        self.retry = retry
+        self.tier = tier
+        # 该任务的性能统计。
+        self.metrics = Metrics()
+        # 该任务已经创建好的目录，同一个目录只创建一次。
+        self.directories = set()
+        # 需要下载的图片数。
+        self.supply = 0
+        # 已下载的图片数。
+        self.downloaded = 0
+        # 下载失败的图片，元素为(插画 ID, 分P序号, 异常)。
+        self.failures = []
+
+    @property
+    def finished(self) -> int:
+        """已经处理完（无论成败）的图片数。"""
+        return self.downloaded + len(self.failures)
+
+    def __repr__(self) -> str:
+        return f'Job({self.name!r}, {self.finished}/{self.supply})'
+
+
+# 当前协程所属的任务。搜索时发出的请求都在任务自己的协程里，据此找到它的重试预算。
+current_job = ContextVar('current_job', default=None)
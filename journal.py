@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+
+
+class Journal:
+    """断点续传日志。
+
+    记录每个未完成下载的链接、完整长度和 ETag，以 JSON 格式保存在磁盘上，
+    程序中断后再次下载同一链接时，可据此决定能否从断点继续。
+    读写都加了锁，可以在文件系统线程池里并发调用。
+    """
+
+    def __init__(self, path: str):
+        """读取日志文件。
+
+        :param path: 日志文件路径。
+        """
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as fr:
+                    self._entries = json.load(fr)
+            # 日志损坏时当作空日志，最多重新下载。
+            except (ValueError, OSError):
+                self._entries = {}
+
+    def __dump(self):
+        """把日志原子地写回磁盘。"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temppath = f'{self.path}.tmp'
+        with open(temppath, 'w', encoding='utf-8') as fw:
+            json.dump(self._entries, fw, ensure_ascii=False)
+        os.replace(temppath, self.path)
+
+    def get(self, url: str) -> dict:
+        """查询链接的下载记录。
+
+        :param url: 图片链接。
+
+        :returns: 记录字典，含 "length" 和 "etag"；没有记录则返回 None。
+        """
+        with self._lock:
+            return self._entries.get(url)
+
+    def record(self, url: str, length: int, etag: str):
+        """登记一个开始下载的链接。
+
+        :param url: 图片链接。
+        :param length: 文件完整长度，未知则为 None。
+        :param etag: 服务器给出的 ETag，没有则为 None。
+        """
+        entry = {'length': length, 'etag': etag}
+        with self._lock:
+            if self._entries.get(url) != entry:
+                self._entries[url] = entry
+                self.__dump()
+
+    def discard(self, url: str):
+        """删除链接的下载记录。
+
+        :param url: 图片链接。
+        """
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self.__dump()
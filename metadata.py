@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+
+
+class Metadata:
+    """插画元数据的本地存储。
+
+    搜索时 API 返回的插画数据（标题、标签、画师、收藏数、日期、分P数等）都存进 SQLite，
+    按标签、画师和收藏数建了索引，查询本地作品时不用再请求网络。
+    """
+
+    def __init__(self, path: str):
+        """打开（或创建）元数据库。
+
+        :param path: 数据库文件路径。
+        """
+        self.path = path
+        # 每写入一批就加1，据此判断由它建立的倒排索引是否过时。
+        self.version = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS illusts (
+                id          INTEGER PRIMARY KEY,
+                title       TEXT    NOT NULL,
+                member_id   INTEGER NOT NULL,
+                member_name TEXT    NOT NULL,
+                bookmarks   INTEGER NOT NULL,
+                page_count  INTEGER NOT NULL,
+                type        TEXT    NOT NULL,
+                create_date TEXT    NOT NULL,
+                data        TEXT    NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS illusts_member ON illusts (member_id);
+            CREATE INDEX IF NOT EXISTS illusts_bookmarks ON illusts (bookmarks);
+            CREATE TABLE IF NOT EXISTS tags (
+                tag       TEXT    NOT NULL COLLATE NOCASE,
+                illust_id INTEGER NOT NULL,
+                PRIMARY KEY (tag, illust_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS tags_illust ON tags (illust_id);
+        ''')
+        self._conn.commit()
+
+    @staticmethod
+    def get_tags(illust: dict) -> set[str]:
+        """取出插画的所有标签，包括标签的译名。
+
+        :param illust: 插画字典。
+
+        :returns: 标签集合。
+        """
+        tags = set()
+        for tag in illust.get('tags', []):
+            for name in (tag.get('name'), tag.get('translated_name')):
+                if name:
+                    tags.add(name)
+        return tags
+
+    def add(self, illusts: list[dict]):
+        """保存一批插画的元数据，已有的会被更新。整批在一个事务里写入。
+
+        和已保存的完全相同的插画不会重写。
+
+        :param illusts: 插画字典列表，空字典会被跳过。
+        """
+        datas = {int(illust['id']): json.dumps(illust, ensure_ascii=False)
+                 for illust in illusts if len(illust) != 0}
+        saved = dict(self._conn.execute(
+            f'SELECT id, data FROM illusts WHERE id IN ({", ".join("?" * len(datas))})', list(datas)))
+        illusts = [illust for illust in illusts if len(illust) != 0
+                   and saved.get(int(illust['id'])) != datas[int(illust['id'])]]
+        if len(illusts) == 0:
+            return
+        self.version += 1
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO illusts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(int(illust['id']),
+                  illust.get('title', ''),
+                  int(illust.get('user', {}).get('id', 0)),
+                  illust.get('user', {}).get('name', ''),
+                  illust.get('total_bookmarks', 0),
+                  illust.get('page_count', 1),
+                  illust.get('type', 'illust'),
+                  illust.get('create_date', ''),
+                  datas[int(illust['id'])]) for illust in illusts])
+            self._conn.executemany(
+                'DELETE FROM tags WHERE illust_id = ?',
+                [(int(illust['id']),) for illust in illusts])
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO tags VALUES (?, ?)',
+                [(tag, int(illust['id'])) for illust in illusts for tag in self.get_tags(illust)])
+
+    @staticmethod
+    def __where(tags: list[str], popularity: int, member_id: int) -> tuple[str, list]:
+        """拼出查询条件。
+
+        多个标签的条件用 INTERSECT 求交集，每个标签都走 tags 表的主键索引。
+
+        :param tags: 插画必须同时带有的标签。
+        :param popularity: 收藏数最低值。
+        :param member_id: 画师 ID，为 None 时不限。
+
+        :returns: WHERE 子句和对应的参数列表。
+        """
+        sql = ' WHERE bookmarks >= ?'
+        params = [popularity]
+        if member_id is not None:
+            sql += ' AND member_id = ?'
+            params.append(int(member_id))
+        if len(tags) != 0:
+            sql += ' AND id IN (' + ' INTERSECT '.join(
+                ['SELECT illust_id FROM tags WHERE tag = ?'] * len(tags)) + ')'
+            params.extend(tags)
+        return sql, params
+
+    def query(self, tags: list[str] = (), popularity: int = 0, member_id: int = None,
+              limit: int = None) -> list[dict]:
+        """查询本地保存的插画。
+
+        :param tags: 插画必须同时带有的标签，不区分大小写。
+        :param popularity: 收藏数最低值。
+        :param member_id: 只要这位画师的插画，为 None 时不限。
+        :param limit: 最多返回几幅，为 None 时不限。
+
+        :returns: 插画字典列表，按收藏数从高到低排列。
+        """
+        where, params = self.__where(tags, popularity, member_id)
+        sql = f'SELECT data FROM illusts{where} ORDER BY bookmarks DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [json.loads(data) for data, in self._conn.execute(sql, params)]
+
+    def get(self, ids: list[int]) -> list[dict]:
+        """按 ID 取出插画字典。
+
+        :param ids: 插画 ID 列表。
+
+        :returns: 插画字典列表，顺序与 ids 相同，没有保存过的会被跳过。
+        """
+        illusts = {}
+        # SQLite 一条语句的参数个数有上限，分批查询。
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self._conn.execute(
+                f'SELECT id, data FROM illusts WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+            illusts.update((id, json.loads(data)) for id, data in rows)
+        return [illusts[id] for id in ids if id in illusts]
+
+    def iter_postings(self):
+        """遍历所有的(标签, 插画 ID)，用于建立倒排索引。
+
+        :returns: 迭代器，每次产出一个(标签, 插画 ID)元组。
+        """
+        return self._conn.execute('SELECT tag, illust_id FROM tags')
+
+    def get_bookmarks(self) -> dict[int, int]:
+        """取出所有插画的收藏数。
+
+        :returns: 插画 ID 到收藏数的字典。
+        """
+        return dict(self._conn.execute('SELECT id, bookmarks FROM illusts'))
+
+    def count(self, tags: list[str] = (), popularity: int = 0, member_id: int = None) -> int:
+        """统计符合条件的本地插画数。参数与 query 相同。
+
+        :returns: 插画数。
+        """
+        where, params = self.__where(tags, popularity, member_id)
+        return self._conn.execute(f'SELECT COUNT(*) FROM illusts{where}', params).fetchone()[0]
+
+    def close(self):
+        """关闭数据库。"""
+        self._conn.close()
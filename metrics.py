@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import aiohttp
+
+
+class RequestTrace:
+    """一次请求各阶段的耗时，由 aiohttp 的 trace 钩子填写。"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        # DNS 解析耗时（秒），复用连接时为0。
+        self.dns = 0.0
+        # 建立连接（含 TLS 握手）的耗时（秒），复用连接时为0。
+        self.connect = 0.0
+        # 收到响应头的时刻，没收到则为 None。
+        self.headers_at = None
+        # 收到的响应体字节数。分块读取时由调用方累加。
+        self.bytes = 0
+        # 各阶段开始的时刻，用于计算耗时。
+        self._dns_start = None
+        self._connect_start = None
+
+
+class Metrics:
+    """一个任务的性能统计。
+
+    按请求种类（API、图片）汇总请求数、失败数、字节数和 DNS/连接/首字节/传输各阶段的耗时，
+    另外统计缓存命中、写盘耗时和同时在途的请求数，据此判断慢在翻页、代理带宽还是磁盘。
+    """
+    # 请求的种类。
+    kinds = ('api', 'image')
+
+    def __init__(self):
+        """初始化统计数据。"""
+        self.started = time.monotonic()
+        self.requests = {kind: {
+            'count': 0,
+            'errors': 0,
+            'bytes': 0,
+            'dns': 0.0,
+            'connect': 0.0,
+            'ttfb': 0.0,
+            'transfer': 0.0
+        } for kind in self.kinds}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # 写临时文件、存储和链接图片花的时间（秒）。
+        self.disk = 0.0
+        # 从任务开始到第一块图片数据写入磁盘的时间（秒），还没写过则为 None。
+        self.first_write = None
+        # 当前在途的请求数和它的峰值。
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @staticmethod
+    def trace_config() -> aiohttp.TraceConfig:
+        """创建 aiohttp 的 trace 配置，把各阶段的时刻记到请求附带的 RequestTrace 上。
+
+        :returns: trace 配置，创建会话时传入。
+        """
+        def hook(handler):
+            async def on_signal(session, context: SimpleNamespace, params):
+                trace = context.trace_request_ctx
+                if isinstance(trace, RequestTrace):
+                    handler(trace, params)
+            return on_signal
+
+        def on_dns_start(trace, params):
+            trace._dns_start = time.monotonic()
+
+        def on_dns_end(trace, params):
+            if trace._dns_start is not None:
+                trace.dns += time.monotonic() - trace._dns_start
+
+        def on_connect_start(trace, params):
+            trace._connect_start = time.monotonic()
+
+        def on_connect_end(trace, params):
+            if trace._connect_start is not None:
+                trace.connect += time.monotonic() - trace._connect_start
+
+        def on_request_end(trace, params):
+            # 对冲请求共用一个 RequestTrace，以先到的响应头为准。
+            if trace.headers_at is None:
+                trace.headers_at = time.monotonic()
+
+        def on_chunk(trace, params):
+            trace.bytes += len(params.chunk)
+
+        config = aiohttp.TraceConfig()
+        config.on_dns_resolvehost_start.append(hook(on_dns_start))
+        config.on_dns_resolvehost_end.append(hook(on_dns_end))
+        config.on_connection_create_start.append(hook(on_connect_start))
+        config.on_connection_create_end.append(hook(on_connect_end))
+        config.on_request_end.append(hook(on_request_end))
+        config.on_response_chunk_received.append(hook(on_chunk))
+        return config
+
+    def begin(self) -> RequestTrace:
+        """开始一次请求。
+
+        :returns: 这次请求的 RequestTrace，作为 trace_request_ctx 传给 aiohttp。
+        """
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return RequestTrace()
+
+    def end(self, kind: str, trace: RequestTrace, failed: bool = False):
+        """结束一次请求，把它的耗时计入统计。
+
+        :param kind: 请求种类，"api" 或 "image"。
+        :param trace: begin 返回的 RequestTrace。
+        :param failed: 请求是否失败。
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+        stats = self.requests[kind]
+        stats['count'] += 1
+        stats['bytes'] += trace.bytes
+        stats['dns'] += trace.dns
+        stats['connect'] += trace.connect
+        if failed:
+            stats['errors'] += 1
+        if trace.headers_at is not None:
+            stats['ttfb'] += trace.headers_at - trace.start
+            stats['transfer'] += now - trace.headers_at
+
+    def add_disk(self, start: float, wrote: bool = False):
+        """记一段写盘耗时。
+
+        :param start: 开始写盘的时刻（time.monotonic）。
+        :param wrote: 是否写入了图片数据，第一次写入时记下首字节落盘的时间。
+        """
+        now = time.monotonic()
+        self.disk += now - start
+        if wrote and self.first_write is None:
+            self.first_write = now - self.started
+
+    def summary(self, retries: int = 0) -> dict:
+        """汇总统计数据。
+
+        :param retries: 任务用掉的重试次数。
+
+        :returns: 可以转成 JSON 的字典，时间的单位都是秒。
+        """
+        return {
+            'elapsed': time.monotonic() - self.started,
+            'requests': {kind: dict(stats) for kind, stats in self.requests.items()},
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'retries': retries,
+            'disk': self.disk,
+            'first_write': self.first_write,
+            'peak_in_flight': self.peak_in_flight
+        }
+
+    @staticmethod
+    def format(summary: dict) -> str:
+        """把汇总数据排成一行给人看的文字。
+
+        :param summary: summary 返回的字典。
+
+        :returns: 一行统计信息。
+        """
+        def average(stats: dict, key: str) -> str:
+            return f'{stats[key] / stats["count"] * 1000:.0f}ms' if stats['count'] else '-'
+        api = summary['requests']['api']
+        image = summary['requests']['image']
+        elapsed = summary['elapsed']
+        parts = [f'API {api["count"]}次(缓存命中{summary["cache_hits"]}次) 平均首字节{average(api, "ttfb")}']
+        if image['count'] != 0:
+            parts.append(f'图片{image["count"]}次 {image["bytes"] / 1024 / 1024:.1f}MB '
+                         f'{image["bytes"] / 1024 / 1024 / elapsed:.2f}MB/s '
+                         f'平均DNS{average(image, "dns")} 连接{average(image, "connect")} '
+                         f'首字节{average(image, "ttfb")} 传输{average(image, "transfer")}')
+            parts.append(f'写盘{summary["disk"]:.2f}s')
+            if summary['first_write'] is not None:
+                parts.append(f'首张落盘{summary["first_write"]:.2f}s')
+        parts.append(f'重试{summary["retries"]}次')
+        parts.append(f'最大并发{summary["peak_in_flight"]}')
+        parts.append(f'用时{elapsed:.1f}s')
+        return ' | '.join(parts)
+
+    @staticmethod
+    def to_prometheus(summaries: dict[str, dict]) -> str:
+        """把各任务的汇总数据转成 Prometheus 文本格式。
+
+        :param summaries: 任务名到 summary 返回的字典。
+
+        :returns: Prometheus 文本格式的指标。
+        """
+        def label(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        lines = []
+        request_metrics = (
+            ('requests_total', 'count', 'counter', '请求数'),
+            ('request_errors_total', 'errors', 'counter', '失败的请求数'),
+            ('received_bytes_total', 'bytes', 'counter', '收到的字节数'),
+            ('dns_seconds_total', 'dns', 'counter', 'DNS 解析总耗时'),
+            ('connect_seconds_total', 'connect', 'counter', '建立连接总耗时'),
+            ('ttfb_seconds_total', 'ttfb', 'counter', '首字节总耗时'),
+            ('transfer_seconds_total', 'transfer', 'counter', '传输总耗时')
+        )
+        for name, key, type, help in request_metrics:
+            lines.append(f'# HELP pixiv_{name} {help}')
+            lines.append(f'# TYPE pixiv_{name} {type}')
+            for job, summary in summaries.items():
+                for kind, stats in summary['requests'].items():
+                    lines.append(f'pixiv_{name}{{job="{label(job)}",kind="{kind}"}} {stats[key]}')
+        job_metrics = (
+            ('cache_hits_total', 'cache_hits', 'counter', '缓存命中数'),
+            ('cache_misses_total', 'cache_misses', 'counter', '缓存未命中数'),
+            ('retries_total', 'retries', 'counter', '重试次数'),
+            ('disk_seconds_total', 'disk', 'counter', '写盘总耗时'),
+            ('peak_in_flight', 'peak_in_flight', 'gauge', '同时在途请求数的峰值'),
+            ('first_write_seconds', 'first_write', 'gauge', '从任务开始到第一块图片数据写入磁盘的时间'),
+            ('job_seconds', 'elapsed', 'gauge', '任务用时')
+        )
+        for name, key, type, help in job_metrics:
+            lines.append(f'# HELP pixiv_{name} {help}')
+            lines.append(f'# TYPE pixiv_{name} {type}')
+            for job, summary in summaries.items():
+                value = summary[key] if summary[key] is not None else 'NaN'
+                lines.append(f'pixiv_{name}{{job="{label(job)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def export(path: str, name: str, summary: dict, summaries: dict[str, dict]):
+        """导出统计数据。
+
+        扩展名为 ".prom" 时，把所有任务的指标写成 Prometheus 文本格式（原子地覆盖）；
+        否则把这个任务的汇总追加为一行 JSON。
+
+        :param path: 导出文件路径。
+        :param name: 任务名。
+        :param summary: 这个任务的汇总数据。
+        :param summaries: 本进程里所有任务的汇总数据，用于 Prometheus 格式。
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path.endswith('.prom'):
+            temppath = f'{path}.tmp'
+            with open(temppath, 'w', encoding='utf-8') as fw:
+                fw.write(Metrics.to_prometheus(summaries))
+            os.replace(temppath, path)
+        else:
+            with open(path, 'a', encoding='utf-8') as fw:
+                fw.write(json.dumps({'job': name, 'time': time.time(), **summary},
+                                    ensure_ascii=False) + '\n')
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+
+from color import Color
+from imagetype import ImageType
+from index import Index
+from pixiv import Pixiv
+
+
+class Migration:
+    """修正输出目录里扩展名不对的图片。
+
+    旧版本把所有图片都存成 ".png"，其实原图常常是 JPEG 或 GIF。
+    这里只读每个文件开头的几个字节判断真实格式，改掉扩展名，并同步更新索引里的路径；文件内容不做任何改动。
+    """
+
+    def __init__(self, output_dir: str, dry_run: bool = False):
+        """初始化迁移。
+
+        :param output_dir: 输出目录。
+        :param dry_run: 为 True 时只列出要改的文件，不真的改名。
+        """
+        self.output_dir = output_dir
+        self.dry_run = dry_run
+        # 改了名的文件数。
+        self.renamed = 0
+        # 因为重名而跳过的文件数。
+        self.skipped = 0
+        indexpath = os.path.join(output_dir, 'index.db')
+        self._index = Index(indexpath) if os.path.exists(indexpath) else None
+
+    def __iter_images(self):
+        """遍历输出目录里的图片，跳过按内容存放的目录和索引文件。
+
+        :returns: 迭代器，每次产出一个图片路径。
+        """
+        for root, dirs, files in os.walk(self.output_dir):
+            if root == self.output_dir and Pixiv.blob_dir in dirs:
+                dirs.remove(Pixiv.blob_dir)
+            for name in files:
+                if os.path.splitext(name)[1].lower() in ImageType.extensions:
+                    yield os.path.join(root, name)
+
+    def __migrate(self, path: str):
+        """修正一个文件的扩展名。
+
+        :param path: 图片路径。
+        """
+        try:
+            extension = ImageType.from_file(path)
+        except OSError as e:
+            print(f'{Color.red}[错误] 读取{path}失败: {e}{Color.end}')
+            return
+        newpath = ImageType.fix_path(path, extension)
+        if newpath == path:
+            return
+        if os.path.lexists(newpath):
+            print(f'{Color.yellow}[提示] {newpath}已经存在，跳过{path}{Color.end}')
+            self.skipped += 1
+            return
+        print(f'{path} -> {os.path.basename(newpath)}')
+        self.renamed += 1
+        if self.dry_run:
+            return
+        os.rename(path, newpath)
+        if self._index is not None:
+            self._index.rename(path, newpath)
+
+    def run(self):
+        """修正输出目录里所有扩展名不对的图片。"""
+        for path in self.__iter_images():
+            self.__migrate(path)
+        if self._index is not None:
+            self._index.close()
+        action = '需要改名' if self.dry_run else '已改名'
+        print(f'{Color.purple}{action}: {self.renamed}个文件, 跳过: {self.skipped}个文件{Color.end}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='按文件开头的魔数修正输出目录里图片的扩展名。')
+    parser.add_argument('--output-dir', metavar='DIR', default=Pixiv.output_dir,
+                        help=f'输出目录，默认为 "{Pixiv.output_dir}"')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只列出要改的文件，不真的改名')
+    args = parser.parse_args()
+    Migration(args.output_dir, args.dry_run).run()
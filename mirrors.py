@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+
+class Endpoint:
+    """地址池里的一个地址及其健康状况。"""
+
+    def __init__(self, url: str):
+        """初始化地址。
+
+        :param url: 地址，例如 "https://proxy.pixivel.moe"。
+        """
+        self.url = url
+        # 延迟的指数加权平均（秒），还没有样本时为 None。
+        self.latency = None
+        # 连续失败的次数。
+        self.failures = 0
+        # 在这个时刻之前不再使用，为0时表示可用。
+        self.down_until = 0.0
+        # 在途请求的开始时刻。
+        self.pending = []
+
+    def estimate(self, default: float) -> float:
+        """估计这个地址现在的延迟。
+
+        在途请求已经等了的时间也算进来，这样还没有样本或者突然变慢的地址不会在第一批响应回来之前分到一大半请求。
+
+        :param default: 还没有样本时使用的延迟（秒）。
+
+        :returns: 延迟（秒）。
+        """
+        latency = self.latency if self.latency is not None else default
+        if len(self.pending) != 0:
+            latency = max(latency, time.monotonic() - min(self.pending))
+        return latency
+
+    @property
+    def healthy(self) -> bool:
+        """是否可用。"""
+        return time.monotonic() >= self.down_until
+
+    def __repr__(self) -> str:
+        return f'Endpoint({self.url!r}, latency={self.latency}, failures={self.failures})'
+
+
+class MirrorPool:
+    """一组可以互相替代的地址（镜像）。
+
+    链接都以第一个地址为准，请求时才换成选中的地址，所以断点续传、缓存和去重不受换地址的影响。
+    选择时按延迟加权，越快的地址越常被选中；某个地址出现过载或连接错误就暂停使用一段时间，
+    立即换另一个地址重试；请求超过 p95 延迟还没有响应时，再向另一个地址发一次（对冲请求），取先到的结果。
+    只有一个地址时，直接请求，没有任何额外开销。
+    """
+    # 延迟的平滑系数，越大越看重最近的样本。
+    alpha = 0.2
+    # 出错后暂停使用的基础时间（秒），连续出错时加倍。
+    cooldown = 5
+    # 暂停使用的最长时间（秒）。
+    max_cooldown = 300
+    # 计算 p95 延迟用的样本数。
+    window = 200
+    # 样本少于这个数时不对冲，免得 p95 不准。
+    min_samples = 20
+
+    def __init__(self, urls: list[str], hedge: bool = True):
+        """初始化地址池。
+
+        :param urls: 地址列表，第一个是链接原本指向的地址。重复的地址会被去掉。
+        :param hedge: 是否发出对冲请求。
+        """
+        self.endpoints = [Endpoint(url.rstrip('/')) for url in dict.fromkeys(urls)]
+        self.primary = self.endpoints[0].url
+        self.hedge = hedge
+        # 最近的延迟样本，不分地址。
+        self._samples = deque(maxlen=self.window)
+        # 发出的对冲请求数。
+        self.hedged = 0
+
+    def resolve(self, url: str, endpoint: Endpoint) -> str:
+        """把以第一个地址为准的链接换成指向另一个地址。
+
+        :param url: 原链接。
+        :param endpoint: 选中的地址。
+
+        :returns: 新链接。
+        """
+        return endpoint.url + url[len(self.primary):]
+
+    def choose(self, exclude: tuple = ()) -> Endpoint:
+        """按延迟加权随机选一个可用的地址。
+
+        权重与延迟的平方成反比，慢一倍的地址只分到四分之一的请求，偶尔被选中也有对冲请求兜底。
+        还没有延迟样本的地址按最快的算，让它有机会被试一试；在途请求等了多久也算进延迟里（见 Endpoint.estimate）。
+        所有地址都在暂停中时，选最早恢复的那个。
+
+        :param exclude: 不要选的地址。
+
+        :returns: 选中的地址；排除后没有可选的时返回 None。
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if len(candidates) == 0:
+            return None
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+        if len(healthy) == 0:
+            return min(candidates, key=lambda endpoint: endpoint.down_until)
+        known = [endpoint.latency for endpoint in healthy if endpoint.latency is not None]
+        fastest = min(known) if len(known) != 0 else 1
+        weights = [1 / max(endpoint.estimate(fastest), 0.001) ** 2 for endpoint in healthy]
+        return random.choices(healthy, weights)[0]
+
+    def succeed(self, endpoint: Endpoint, latency: float = None):
+        """记录一次成功的请求。
+
+        :param endpoint: 地址。
+        :param latency: 这次请求的延迟（秒），为 None 时只恢复可用状态。
+        """
+        endpoint.failures = 0
+        endpoint.down_until = 0.0
+        if latency is not None:
+            endpoint.latency = latency if endpoint.latency is None else (
+                endpoint.latency + (latency - endpoint.latency) * self.alpha)
+            self._samples.append(latency)
+
+    def fail(self, endpoint: Endpoint):
+        """记录一次失败的请求，暂停使用这个地址，连续失败时暂停得更久。
+
+        :param endpoint: 地址。
+        """
+        endpoint.failures += 1
+        if len(self.endpoints) > 1:
+            endpoint.down_until = time.monotonic() + min(
+                self.cooldown * 2 ** (endpoint.failures - 1), self.max_cooldown)
+
+    def hedge_delay(self) -> float:
+        """对冲请求前等待的时间，即最近请求延迟的 p95。
+
+        :returns: 等待时间（秒）；样本不够或不对冲时返回 None。
+        """
+        if not self.hedge or len(self._samples) < self.min_samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[int(len(samples) * 0.95)]
+
+    async def __attempt(self, endpoint: Endpoint, url: str, request: Callable[[str], Awaitable],
+                        is_fault: Callable[[BaseException], bool]) -> Any:
+        """向一个地址发出请求，并记录它的表现。
+
+        :param endpoint: 地址。
+        :param url: 原链接。
+        :param request: 发出请求的协程函数，参数为实际请求的链接。
+        :param is_fault: 判断一个异常是不是地址本身的问题（过载、连接错误等）。
+
+        :returns: 请求的结果。
+        """
+        start = time.monotonic()
+        endpoint.pending.append(start)
+        try:
+            result = await request(self.resolve(url, endpoint))
+        except Exception as e:
+            if is_fault(e):
+                self.fail(endpoint)
+            else:
+                self.succeed(endpoint)
+            raise
+        finally:
+            endpoint.pending.remove(start)
+        self.succeed(endpoint, time.monotonic() - start)
+        return result
+
+    async def call(self, url: str, request: Callable[[str], Awaitable],
+                   is_fault: Callable[[BaseException], bool],
+                   discard: Callable[[Any], Any] = None) -> Any:
+        """通过地址池发出请求。
+
+        先向选中的地址请求；超过 p95 延迟还没响应，就再向另一个地址请求，取先成功的结果。
+        地址本身出问题时，立即换一个还没试过的地址，所有地址都失败才抛出最后一个异常。
+        不是地址的问题（比如 404）时直接抛出，不换地址。
+
+        :param url: 以第一个地址为准的链接。不指向第一个地址的链接直接请求。
+        :param request: 发出请求的协程函数，参数为实际请求的链接。
+        :param is_fault: 判断一个异常是不是地址本身的问题。
+        :param discard: 处理没被采用的结果的函数（比如释放响应），为 None 时不处理。
+
+        :returns: 请求的结果。
+        """
+        if len(self.endpoints) == 1 or not url.startswith(self.primary):
+            return await request(url)
+        tried = []
+        running = set()
+        error = None
+
+        def launch() -> asyncio.Future:
+            endpoint = self.choose(exclude=tuple(tried))
+            if endpoint is None:
+                return None
+            tried.append(endpoint)
+            task = asyncio.ensure_future(self.__attempt(endpoint, url, request, is_fault))
+            running.add(task)
+            return task
+
+        launch()
+        try:
+            while len(running) != 0:
+                # 只有一个请求在途、还有别的地址时，最多等到 p95 延迟就对冲。
+                delay = None
+                if len(running) == 1 and len(tried) < len(self.endpoints):
+                    delay = self.hedge_delay()
+                done, running = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if len(done) == 0:
+                    if launch() is not None:
+                        self.hedged += 1
+                    continue
+                succeeded = [task for task in done if task.exception() is None]
+                if len(succeeded) != 0:
+                    # 同时成功的其他结果不要了。
+                    for task in succeeded[1:]:
+                        if discard is not None:
+                            discard(task.result())
+                    return succeeded[0].result()
+                for task in done:
+                    error = task.exception()
+                    # 不是地址的问题，换地址也没用。
+                    if not is_fault(error):
+                        raise error
+                # 都失败了，还有没试过的地址就换一个。
+                if len(running) == 0:
+                    launch()
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
+            if len(running) != 0:
+                for result in await asyncio.gather(*running, return_exceptions=True):
+                    if not isinstance(result, BaseException) and discard is not None:
+                        discard(result)
+
+    async def check(self, probe: Callable[[str], Awaitable[bool]]):
+        """主动检查暂停中的地址，能连上就恢复使用。
+
+        :param probe: 检查一个地址的协程函数，参数为地址，能用时返回 True。
+        """
+        async def check_one(endpoint: Endpoint):
+            try:
+                alive = await probe(endpoint.url)
+            except Exception:
+                alive = False
+            if alive:
+                self.succeed(endpoint)
+            else:
+                self.fail(endpoint)
+        await asyncio.gather(*[check_one(endpoint) for endpoint in self.endpoints
+                               if endpoint.failures != 0])
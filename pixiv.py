@@ -1,18 +1,40 @@
 # -*- coding: utf-8 -*-
+import argparse
 import asyncio
+import hashlib
+import math
 import os
 import re
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable
 
 import aiofiles
 import aiohttp
 from eprogress import LineProgress
-import requests
 
+from cache import ResponseCache
 from color import Color
 from help import Help
-
-asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+from imagetype import ImageType
+from index import Index
+from job import Job, current_job
+from journal import Journal
+from metadata import Metadata
+from metrics import Metrics, RequestTrace
+from mirrors import MirrorPool
+from retry import HTTPStatusError, RetryPolicy
+from scheduler import Scheduler, TokenBucket
+from tagindex import TagIndex
+from ugoira import Ugoira
+from watchlist import Watchlist
+
+# Windows 下改用 Selector 事件循环，其他平台保持默认。
+if os.name == 'nt':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
 class Pixiv:
@@ -23,29 +45,215 @@ class Pixiv:
     }
     # 输出目录。
     output_dir = 'outputs'
+    # 下载中的临时文件目录，须与输出目录在同一文件系统上，才能原子地重命名。
+    temp_dir = 'temp'
+    # 按内容哈希存放图片的目录名，位于输出目录下。输出目录里的图片都是指向这里的硬链接，内容相同的图片只占一份空间。
+    blob_dir = '.blobs'
+    # 流式写入时每块的字节数。
+    chunk_size = 64 * 1024
+    # 断点续传日志。
+    _journal = None
+    # 已下载图片的索引。
+    _index = None
+    # 插画元数据的本地存储。
+    _metadata = None
+    # 查询本地插画时最多显示的条数。
+    query_limit = 20
+    # 由元数据建立的标签倒排索引，元数据有更新时重建。
+    _tag_index = None
+    # 建立倒排索引时元数据的版本。
+    _tag_index_version = None
+    # API 响应的缓存目录。
+    cache_dir = 'cache'
+    # API 响应缓存的总字节数上限。
+    cache_size = 64 * 1024 * 1024
+    # 各类请求的缓存时间（秒），为0则不缓存。往日的排行榜不会再变，另行永久缓存。
+    cache_ttls = {
+        'illust': 24 * 3600,
+        'member': 24 * 3600,
+        'member_illust': 10 * 60,
+        'rank': 10 * 60,
+        'search': 10 * 60,
+        'ugoira_metadata': 24 * 3600
+    }
+    # API 响应缓存。
+    _cache = None
+    # 单次请求最多尝试的次数。
+    max_attempts = 4
+    # 第一次重试前的基准等待时间（秒）。
+    retry_base_delay = 0.5
+    # 单次重试等待时间的上限（秒）。
+    retry_max_delay = 30
+    # 每条指令里所有请求加起来最多重试的次数。
+    retry_budget = 100
+    # 重试策略。
+    _retry = None
+    # 性能统计的导出路径，扩展名为 ".prom" 时导出 Prometheus 文本格式，否则追加 JSON 行；为 None 时不导出。
+    metrics_path = None
+    # 不属于任何任务的请求的性能统计。
+    _metrics = None
+    # 本进程里各任务的性能统计汇总，导出 Prometheus 格式时用。
+    _summaries = {}
     # 国内 Pixiv 的 api 地址。
     api_url = 'https://api.pixivel.moe/pixiv'
+    # API 的备用地址，与 api_url 一起组成 API 地址池。
+    api_mirrors = []
+    # 图片代理的地址池，第一个是图片链接默认指向的代理，其余为备用。
+    image_mirrors = ['https://proxy.pixivel.moe']
+    # 请求超过最近的 p95 延迟还没响应时，是否向地址池里的另一个地址再发一次（对冲请求）。
+    hedge_requests = True
+    # 地址池健康检查的间隔（秒）。
+    health_interval = 30
+    # API 和图片代理的地址池。
+    _api_pool = None
+    _image_pool = None
+    # 定时检查地址池的任务。
+    _health = None
     # 一页能显示的图片数量。
     page_quantity = 30
+    # 翻页时同时请求的页数。
+    search_window = 4
+    # 每秒最多向 API 发起的请求数（不含命中缓存的），下载再多也不会给服务器添太多麻烦。
+    api_rate = 5
+    # 允许向 API 突发的请求数。
+    api_burst = 5
+    # API 请求的限速器。
+    _api_bucket = None
     # 排行榜可选的模式。
     rank_modes = ('day', 'week', 'month', 'male',
                   'female', 'original', 'rookie', 'manga')
+    # 可选的图片尺寸，值为 API 数据里对应的链接键名。
+    size_tiers = {
+        'square': 'square_medium',
+        'medium': 'medium',
+        'large': 'large',
+        'original': 'original'
+    }
+    # 指令没有指定尺寸时下载的尺寸。
+    default_tier = 'original'
+    # 预览图的目录名，位于输出目录下，按尺寸分子目录。
+    preview_dir = 'previews'
+    # 当前这条指令指定的尺寸，为 None 时按各功能的默认尺寸。
+    _tier = None
+    # 下载原图时动图 zip 包的分辨率。API 只给出600x600的链接，改成这个就是原尺寸。
+    ugoira_resolution = '1920x1080'
+    # 动图合成的格式，可选 "gif" 或 "webp"，为 None 时只解压出各帧。需要安装 Pillow。
+    ugoira_format = None
+    # 合成动图的进程数。
+    ugoira_workers = 2
+    # 合成动图的进程池。
+    _pool = None
+    # 归档排行榜时，同时爬取的排行榜数。
+    archive_concurrency = 4
+    # 第一次同步关注的画师时，下载最新的几幅插画。
+    follow_initial = 30
+    # 关注的画师列表。
+    _watchlist = None
     # 功能汇总。
-    functions = ('id', 'member', 'rank', 'tag', 'help')
-    # 实际拿到的插画数。
-    _supply = 0
-    # 已下载的插画数。
-    _downloaded = 0
+    functions = ('id', 'member', 'rank', 'tag', 'archive', 'follow', 'promote', 'query', 'cache', 'help')
+    # 正在进行的任务。
+    _jobs = []
+    # 批处理时收集的任务协程，为 None 时每条指令立即执行。
+    _batch = None
+    # 已经交给调度器、还没下载完的图片，元素为(插画 ID, 分P序号, 尺寸)，多条指令共用。
+    # 下载完就移除，之后由索引判断是否下载过，文件被删了还能从按内容存放的那份恢复。
+    _scheduled = set()
     # 进度条实例。
     _bar = LineProgress(total=100, title='下载进度')
+    # 连接池的总连接数上限。
+    connection_limit = 100
+    # 连接池对同一主机的连接数上限，不应少于同时下载的图片数的最大值。
+    connection_limit_per_host = 16
+    # DNS 解析结果的缓存时间（秒）。
+    dns_cache_ttl = 300
+    # 空闲连接的保活时间（秒）。
+    keepalive_timeout = 30
+    # 所有下载共用的协程会话。
+    _session = None
+    # 同时下载的图片数的初始上限。
+    concurrency = 8
+    # 是否根据吞吐量、延迟和过载错误自动调整同时下载的图片数。
+    adaptive_concurrency = True
+    # 自动调整时，同时下载的图片数的最小值和最大值。
+    min_concurrency = 1
+    max_concurrency = 16
+    # 所有下载加起来每秒最多接收的字节数，为 None 时不限。
+    max_bandwidth = None
+    # 全局带宽的限速器。
+    _bandwidth = None
+    # 每个主机每秒允许发起的请求数。
+    host_rate = 20
+    # 每个主机允许的突发请求数。
+    host_burst = 10
+    # 每个任务下载队列的长度上限。
+    queue_size = 32
+    # 所有任务共用的下载调度器。
+    _scheduler = None
+    # 文件系统操作（建目录、检查文件、移动、链接）的线程数。
+    fs_workers = 8
+    # 文件系统操作专用的线程池，网络文件系统卡住时也不阻塞异步循环。
+    _fs_pool = None
+    # 标题里不能用作文件或文件夹名的字符。
+    _unsafe_chars = re.compile(r'[\|/:*?"<>]')
 
     def __init__(self):
         """初始化应用。"""
-        # 创建输出目录。
-        if not os.path.exists(self.output_dir):
-            os.mkdir(self.output_dir)
+        # 创建输出目录、临时目录和缓存目录。
+        for directory in (self.output_dir, self.temp_dir, self.cache_dir):
+            os.makedirs(directory, exist_ok=True)
+        # 读取断点续传日志。
+        Pixiv._journal = Journal(os.path.join(self.temp_dir, 'journal.json'))
+        # 打开已下载图片的索引。
+        Pixiv._index = Index(os.path.join(self.output_dir, 'index.db'))
+        # 打开插画元数据库。
+        Pixiv._metadata = Metadata(os.path.join(self.output_dir, 'metadata.db'))
+        # 读取关注的画师列表。
+        Pixiv._watchlist = Watchlist(os.path.join(self.output_dir, 'watchlist.json'))
+        # 打开 API 响应缓存。
+        Pixiv._cache = ResponseCache(os.path.join(
+            self.cache_dir, 'responses.db'), self.cache_size)
+        # 创建 API 请求的限速器。
+        Pixiv._api_bucket = TokenBucket(self.api_rate, self.api_burst)
+        # 初始化默认的重试策略和性能统计，不属于任何任务的请求使用它们。
+        Pixiv._retry = self.__new_retry()
+        Pixiv._metrics = Metrics()
+        # 创建共用的下载调度器，不自动调整时并发数固定为初始上限。
+        adaptive = self.adaptive_concurrency
+        Pixiv._scheduler = Scheduler(self.__download_image,
+                                     concurrency=self.concurrency,
+                                     rate=self.host_rate,
+                                     burst=self.host_burst,
+                                     queue_size=self.queue_size,
+                                     min_concurrency=self.min_concurrency if adaptive else self.concurrency,
+                                     max_concurrency=self.max_concurrency if adaptive else self.concurrency)
+        # 创建 API 和图片代理的地址池。
+        Pixiv._api_pool = MirrorPool([self.api_url, *self.api_mirrors], self.hedge_requests)
+        Pixiv._image_pool = MirrorPool(self.image_mirrors, self.hedge_requests)
+        # 创建文件系统操作的线程池。
+        Pixiv._fs_pool = ThreadPoolExecutor(max_workers=self.fs_workers, thread_name_prefix='pixiv-fs')
+        # 创建全局带宽的限速器，突发量为一块数据。
+        if self.max_bandwidth is not None:
+            Pixiv._bandwidth = TokenBucket(self.max_bandwidth, self.chunk_size)
+        # 没装 Pillow 就只解压帧。
+        if self.ugoira_format is not None and not Ugoira.can_assemble():
+            self.__warning('[提示] 没有安装 Pillow，动图只会解压出各帧，不会合成。')
+            Pixiv.ugoira_format = None
         # 启动异步循环。
         Pixiv.__loop = asyncio.get_event_loop()
+        # 有备用地址时，定时检查暂停使用的地址。
+        if len(self._api_pool.endpoints) > 1 or len(self._image_pool.endpoints) > 1:
+            Pixiv._health = self.__loop.create_task(self.__check_health())
+
+    @classmethod
+    def __new_retry(cls) -> RetryPolicy:
+        """按配置创建一份重试策略。
+
+        :returns: 重试策略，带有一份完整的重试预算。
+        """
+        return RetryPolicy(max_attempts=cls.max_attempts,
+                           base_delay=cls.retry_base_delay,
+                           max_delay=cls.retry_max_delay,
+                           budget=cls.retry_budget)
 
     @staticmethod
     def __prompt(message: str, end='\n', flush=False):
@@ -73,29 +281,34 @@ class Pixiv:
         """
         print(f'{Color.red}{message}{Color.end}')
 
-    @staticmethod
-    def __to_local(url: str) -> str:
+    @classmethod
+    def __to_local(cls, url: str) -> str:
         """转换为国内地址。
 
         Pixiv 的图片地址无法直接访问，需要通过代理网站转换为国内可访问的地址。
+        这里总是换成图片地址池里的第一个地址，下载时才由地址池决定实际请求哪个地址。
 
         :param url: 原地址，源于 Pixiv。
 
         :returns: 国内可直接访问或爬取的地址。
         """
-        # 将地址头改为 "proxy.pixivel.moe"。
-        return re.sub('i.pximg.net', 'proxy.pixivel.moe', url)
+        # 将地址头改为图片代理，默认为 "proxy.pixivel.moe"。
+        return re.sub('https://i.pximg.net', cls._image_pool.primary, url)
 
     @classmethod
     def __get_page_num(cls, quantity: str) -> tuple[int, int]:
         """决定爬取的页数。
 
         网站每页只显示固定数量的插画，该函数可根据用户需要的插画数量，决定爬取几页。
+        数量为 "all" 时不限数量，一直爬到最后一页。
 
         :param quantity: 用户需要的插画数量。
 
-        :returns: 转换成整型的数量和程序需要爬取的页数。
+        :returns: 转换成整型的数量和程序需要爬取的页数，不限数量时都是无穷大。
         """
+        # 不限数量。
+        if quantity == 'all':
+            return math.inf, math.inf
         # 检查 quantity 合法性。
         if re.fullmatch('\d+', quantity):
             quantity = int(quantity)
@@ -106,77 +319,589 @@ class Pixiv:
         if quantity < 1:
             cls.__error('[错误] 好歹得下个1幅罢(')
             return quantity, 0
-        # 数量至多为100。
-        if quantity > 100:
-            cls.__error('[错误] 一次下载太多图片，有可能损坏别人的服务器的...')
-            return quantity, 0
+        # 数量不设上限，请求的频率由限速器控制。
         # 确定爬取页面数。
-        page_num = (quantity - 1) // 30 + 1
+        page_num = (quantity - 1) // cls.page_quantity + 1
         # 同时返回整型的 quantity。
         return quantity, page_num
 
     @classmethod
-    def __request(cls, url: str, params: dict = {}) -> requests.Response:
-        """发送同步请求。
+    async def __request(cls, url: str, params: dict = {}) -> dict:
+        """发送异步请求。
 
-        向指定的站点发送请求，成功返回响应，失败报错。
+        用共享的协程会话向指定的站点发送请求，成功返回解析好的 JSON，失败报错。
+        缓存里有未过期的响应时，直接返回缓存，不发请求；遇到暂时性错误时按重试策略重试。
 
         :param url: 目标站点地址。
         :param params: 查询字符串参数。
 
-        :returns: 网站响应。
+        :returns: 网站响应的 JSON 数据，失败时为空字典。
         """
-        response = requests.get(url, headers=cls.headers, params=params)
-        # 响应失败则报错：
-        if response.status_code != 200:
-            cls.__error(f'''[错误] 对 {url} 的请求失败了!
-            状态码: {response.status_code}''')
-            return None
-        # 响应成功则返回响应。
-        else:
-            return response
+        # 先查缓存。
+        metrics = cls.__get_metrics()
+        key = cls._cache.make_key(url, params)
+        data = cls._cache.get(key)
+        if data is not None:
+            metrics.cache_hits += 1
+            return data
+        metrics.cache_misses += 1
+        try:
+            data = await cls.__get_retry().call(cls.__fetch_json, url, params)
+        # 重试也没用就报错。
+        except Exception as e:
+            cls.__error(f'[错误] {e}')
+            return {}
+        # 写入缓存。
+        ttl = cls.__get_cache_ttl(params, data)
+        if ttl != 0:
+            cls._cache.put(key, data, ttl)
+        return data
+
+    @classmethod
+    def __get_retry(cls) -> RetryPolicy:
+        """取得当前任务的重试策略。
+
+        :returns: 当前任务的重试策略；不在任务里时返回默认的重试策略。
+        """
+        job = current_job.get()
+        return job.retry if job is not None else cls._retry
+
+    @classmethod
+    def __get_metrics(cls) -> Metrics:
+        """取得当前任务的性能统计。
+
+        :returns: 当前任务的性能统计；不在任务里时返回默认的性能统计。
+        """
+        job = current_job.get()
+        return job.metrics if job is not None else cls._metrics
+
+    @classmethod
+    async def __in_fs_pool(cls, function: Callable, *args):
+        """在文件系统线程池里执行同步函数。
+
+        :param function: 同步函数。
+        :param args: 传给函数的参数。
+
+        :returns: 函数的返回值。
+        """
+        return await asyncio.get_running_loop().run_in_executor(cls._fs_pool, function, *args)
+
+    @classmethod
+    async def __fetch_json(cls, url: str, params: dict) -> dict:
+        """发送一次请求并解析 JSON。
+
+        :param url: 目标站点地址。
+        :param params: 查询字符串参数。
+
+        :returns: 网站响应的 JSON 数据。
+        """
+        session = await cls.__get_session()
+        metrics = cls.__get_metrics()
+        trace = metrics.begin()
+        failed = False
+
+        async def request(mirror_url: str) -> dict:
+            # 限速，别把服务器累坏了。对冲请求和换地址重发的请求也各要一个令牌。
+            await cls._api_bucket.acquire()
+            async with session.get(mirror_url, params=params, trace_request_ctx=trace) as response:
+                # 响应失败则抛出异常，由地址池决定是否换地址，再由重试策略决定是否重试。
+                if response.status != 200:
+                    raise HTTPStatusError(mirror_url, response.status,
+                                          response.headers.get('Retry-After'))
+                # 响应成功则返回数据。
+                return await response.json(content_type=None)
+        try:
+            # 从 API 地址池里选一个地址请求，慢了就对冲，地址出问题就换一个。
+            return await cls._api_pool.call(url, request, cls._retry.is_retryable)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            metrics.end('api', trace, failed)
+
+    @classmethod
+    def __get_cache_ttl(cls, params: dict, data: dict) -> float:
+        """决定一条响应的缓存时间。
+
+        :param params: 请求的查询字符串参数。
+        :param data: 响应的 JSON 数据。
+
+        :returns: 缓存时间（秒），None 表示永久缓存，0表示不缓存。
+        """
+        type = params.get('type')
+        # 往日的排行榜已经定下来了，永久缓存；但还没出榜时的空结果不能缓存。
+        if type == 'rank':
+            if len(data.get('illusts', [])) == 0:
+                return 0
+            if params.get('date', '') < datetime.now().strftime('%F'):
+                return None
+        return cls.cache_ttls.get(type, 0)
+
+    @classmethod
+    def __request_pages(cls, params_list: list[dict]) -> list[asyncio.Task]:
+        """同时请求多页。
+
+        :param params_list: 每一页的查询字符串参数。
+
+        :returns: 按页码排列的请求任务列表。
+        """
+        return [asyncio.ensure_future(cls.__request(cls.api_url, params))
+                for params in params_list]
 
     @classmethod
-    async def __download_image(cls, url: str, filepath: str):
+    async def __iter_pages(cls, get_params: Callable[[int], dict], quantity: float, page_num: float,
+                           first: asyncio.Task = None) -> AsyncIterator[list[dict]]:
+        """按页码顺序逐页产出插画列表。
+
+        同时请求一个滑动窗口内的若干页，哪一页先到都得按顺序等；每取出一页就补发窗口后面一页的请求，
+        所以不论要多少幅，同时在途的请求和暂存的页数都不超过窗口大小。
+        下载队列满时，这里也会停下来等，不会越跑越远。遇到空页或数量已够，就取消窗口里剩下的请求。
+
+        :param get_params: 根据页码（从0开始）生成查询字符串参数的函数。
+        :param quantity: 需求数量，可以是无穷大。
+        :param page_num: 最多爬取的页数，可以是无穷大。
+        :param first: 已经发出的第1页请求，没有则为 None。
+
+        :returns: 异步迭代器，每次产出一页里需要的插画。
+        """
+        def request(page: int) -> asyncio.Task:
+            return asyncio.ensure_future(cls.__request(cls.api_url, get_params(page)))
+        window = min(cls.search_window, page_num)
+        # 先发出窗口内各页的请求。
+        tasks = deque([] if first is None else [first])
+        tasks.extend(request(page) for page in range(len(tasks), window))
+        try:
+            page = 0
+            while len(tasks) != 0:
+                # 该页所有插画的列表。
+                cur_page_illusts = (await tasks.popleft()).get('illusts', [])
+                # 如果该页没有插画，说明接下来也不会有了。
+                if len(cur_page_illusts) == 0:
+                    break
+                # 确定想要从这一页下载几幅插画。
+                # - 需求还剩几张？
+                # - 该页还剩几张？
+                # 从这两个数中选最小的。
+                desire_len = min(quantity - page *
+                                 cls.page_quantity, len(cur_page_illusts))
+                if desire_len <= 0:
+                    break
+                # 窗口向后滑动一页。
+                if page + window < page_num:
+                    tasks.append(request(page + window))
+                yield cur_page_illusts[:desire_len]
+                page += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @classmethod
+    async def __get_session(cls) -> aiohttp.ClientSession:
+        """获取共享的协程会话。
+
+        首次调用时创建带连接池的会话，此后所有下载都复用它的 TCP/TLS 连接。
+
+        :returns: 协程会话。
+        """
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=cls.connection_limit,
+                limit_per_host=cls.connection_limit_per_host,
+                ttl_dns_cache=cls.dns_cache_ttl,
+                keepalive_timeout=cls.keepalive_timeout)
+            cls._session = aiohttp.ClientSession(
+                connector=connector, headers=cls.headers,
+                trace_configs=[Metrics.trace_config()])
+        return cls._session
+
+    @classmethod
+    async def __check_health(cls):
+        """定时检查地址池里暂停使用的地址，能连上就恢复使用。"""
+        async def probe(url: str) -> bool:
+            session = await cls.__get_session()
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                # 能返回响应、不是服务器错误，就算能用。
+                return response.status < 500
+        while True:
+            await asyncio.sleep(cls.health_interval)
+            await asyncio.gather(cls._api_pool.check(probe), cls._image_pool.check(probe))
+
+    @classmethod
+    async def __download_image(cls, url: str, filepath: str, illust_id: int, page: int, job: Job, frames: list[dict] = None):
         """异步下载图片。
 
-        对图片链接发起异步请求，保存到指定路径。
+        对图片链接发起异步请求，保存到指定路径，并登记到索引里。
+        遇到暂时性错误时按重试策略重试，最终失败的图片记录下来，最后统一报告。
 
         :param url: 图片链接。
         :param filepath: 存储路径。
+        :param illust_id: 插画 ID。
+        :param page: 分P序号，从0开始。
+        :param job: 图片所属的任务。
+        :param frames: 动图的帧列表，不是动图则为 None。
         """
-        # 创建协程对话。
-        async with aiohttp.ClientSession() as session:
-            # 异步获取响应。
-            async with await session.get(url, headers=cls.headers) as response:
-                # 响应失败：
-                if response.status != 200:
-                    # 报错。
-                    cls.__error(f'''[错误] 对 {url} 的请求失败了!
-                    状态码: {response.status}''')
-                # 响应成功：
-                else:
-                    # 以字节形式读取响应。
-                    content = await response.read()
-                    # 持久化存储。
-                    try:
-                        async with aiofiles.open(filepath, 'wb') as fw:
-                            await fw.write(content)
-                    except FileNotFoundError:
-                        if not os.path.exists(cls.output_dir):
-                            os.mkdir(cls.output_dir)
+        try:
+            result = await job.retry.call(cls.__fetch_image, url, filepath, job.metrics)
+            # 动图还要解压成帧，处理完才算下载完成。
+            if frames is not None:
+                start = time.monotonic()
+                await cls.__process_ugoira(result[0], frames)
+                job.metrics.add_disk(start)
+        # 下载失败就记下来，之后的指令还可以再试。
+        except Exception as e:
+            job.failures.append((illust_id, page, e))
+        # 下载成功就登记到索引，路径以按真实格式修正过的为准。
+        else:
+            cls._index.add(illust_id, page, *result, tier=job.tier)
+            job.downloaded += 1
+        finally:
+            cls._scheduled.discard((illust_id, page, job.tier))
         # 更新进度条。
-        cls._downloaded += 1
-        percent = cls._downloaded / cls._supply * 100
+        cls.__update_bar()
+
+    @classmethod
+    async def __process_ugoira(cls, zippath: str, frames: list[dict]):
+        """把下载好的动图 zip 包解压到同名目录，需要时再合成动图。
+
+        解压在线程池里进行，合成在进程池里进行，都不阻塞下载。
+
+        :param zippath: zip 包路径。
+        :param frames: API 给出的帧列表，元素为含 "file" 和 "delay" 的字典。
+        """
+        loop = asyncio.get_running_loop()
+        target_dir = os.path.splitext(zippath)[0]
+        framepaths = await loop.run_in_executor(
+            cls._fs_pool, Ugoira.extract, zippath, target_dir, frames, cls.chunk_size)
+        if cls.ugoira_format is None:
+            return
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(max_workers=cls.ugoira_workers)
+        await loop.run_in_executor(
+            cls._pool, Ugoira.assemble, framepaths,
+            [frame['delay'] for frame in frames], f'{target_dir}.{cls.ugoira_format}')
+
+    @classmethod
+    async def __fetch_image(cls, url: str, filepath: str, metrics: Metrics) -> tuple[str, int, str]:
+        """请求图片并写入存储路径，支持断点续传。
+
+        如果上次留下了临时文件和日志记录，就用 Range 请求只下载剩下的部分；
+        服务器不支持 Range 或文件已变化时，退回完整下载。
+
+        :param url: 图片链接。
+        :param filepath: 存储路径。
+        :param metrics: 所属任务的性能统计。
+
+        :returns: 实际的存储路径、文件的字节数和 SHA-256。
+        """
+        # 取得共享的协程会话。
+        session = await cls.__get_session()
+        temppath = cls.__get_temp_path(url)
+        # 临时文件和日志记录都在，才能从断点继续。
+        entry = cls._journal.get(url)
+        offset = 0
+        if entry is not None:
+            offset = await cls.__in_fs_pool(cls.__get_size, temppath)
+        headers = {}
+        if offset > 0:
+            headers['Range'] = f'bytes={offset}-'
+            # 文件在服务器上变了的话，服务器会忽略 Range 返回完整文件。
+            if entry['etag'] is not None:
+                headers['If-Range'] = entry['etag']
+        trace = metrics.begin()
+        error = None
+
+        async def request(mirror_url: str) -> aiohttp.ClientResponse:
+            response = await session.get(mirror_url, headers=headers, trace_request_ctx=trace)
+            # 限流和服务器错误是地址的问题，抛出异常让地址池换一个地址。
+            if response.status == 429 or response.status >= 500:
+                response.release()
+                raise HTTPStatusError(mirror_url, response.status, response.headers.get('Retry-After'))
+            return response
+        try:
+            # 从图片地址池里选一个地址请求，拿到响应头就算请求成功；慢了就对冲，地址出问题就换一个。
+            response = await cls._image_pool.call(
+                url, request, cls._retry.is_retryable, lambda response: response.release())
+            async with response:
+                # 从断点继续：
+                if response.status == 206:
+                    # 返回的片段对不上断点，或者文件总长和上次记下的不一样（没有 ETag 可用 If-Range 时，
+                    # 服务器上变了的文件也会返回 206），就丢掉临时文件重新下载。
+                    if (cls.__get_range_start(response) != offset
+                            or cls.__get_full_length(response, offset) != entry['length']):
+                        await cls.__in_fs_pool(cls.__discard_temp, url)
+                        return await cls.__fetch_image(url, filepath, metrics)
+                    return await cls.__stream_to_file(response, url, filepath, offset, metrics, trace)
+                # 完整下载（服务器不支持 Range 时也是这种情况）：
+                elif response.status == 200:
+                    return await cls.__stream_to_file(response, url, filepath, 0, metrics, trace)
+                # 断点已在文件末尾：
+                elif response.status == 416 and offset > 0:
+                    # 上次其实已经下完了，直接移动到存储路径。
+                    if offset == entry['length']:
+                        digest = hashlib.sha256()
+                        await cls.__hash_file(temppath, digest)
+                        return await cls.__in_fs_pool(cls.__finish_temp, url, filepath, digest)
+                    # 否则丢掉临时文件重新下载。
+                    else:
+                        await cls.__in_fs_pool(cls.__discard_temp, url)
+                        return await cls.__fetch_image(url, filepath, metrics)
+                # 响应失败则抛出异常，由重试策略决定是否重试。
+                else:
+                    raise HTTPStatusError(url, response.status,
+                                          response.headers.get('Retry-After'))
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            metrics.end('image', trace, error is not None)
+            # 把这次请求的延迟、字节数和是否过载告诉并发控制，被取消的请求不算。
+            if not isinstance(error, asyncio.CancelledError):
+                cls._scheduler.limit.observe(
+                    trace.headers_at - trace.start if trace.headers_at is not None else None,
+                    trace.bytes, error is not None and cls._retry.is_retryable(error))
+
+    @classmethod
+    def __get_temp_path(cls, url: str) -> str:
+        """决定图片下载过程中的临时文件路径。
+
+        :param url: 图片链接。
+
+        :returns: 临时文件路径，文件名由链接的哈希值决定。
+        """
+        name = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(cls.temp_dir, f'{name}.part')
+
+    @staticmethod
+    def __get_range_start(response: aiohttp.ClientResponse) -> int:
+        """解析 206 响应的 Content-Range 头，得到片段的起始位置。
+
+        :param response: 图片的响应。
+
+        :returns: 起始字节位置，无法解析则返回 None。
+        """
+        match = re.fullmatch(r'bytes (\d+)-\d+/(\d+|\*)',
+                             response.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def __get_full_length(response: aiohttp.ClientResponse, offset: int) -> int:
+        """计算文件的完整长度。
+
+        :param response: 图片的响应。
+        :param offset: 本次响应的起始字节位置。
+
+        :returns: 完整长度，未知则返回 None。
+        """
+        total = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+        if total:
+            return int(total.group(1))
+        if response.content_length is not None:
+            return offset + response.content_length
+        return None
+
+    @classmethod
+    async def __stream_to_file(cls, response: aiohttp.ClientResponse, url: str, filepath: str, offset: int,
+                               metrics: Metrics, trace: RequestTrace) -> tuple[str, int, str]:
+        """把响应分块写入临时文件，完成后原子地移动到存储路径。
+
+        内存占用只与块大小有关，输出目录里也不会出现写了一半的图片。
+        下载中断时临时文件会保留下来，下次从断点继续。
+
+        :param response: 图片的响应。
+        :param url: 图片链接。
+        :param filepath: 存储路径。
+        :param offset: 本次响应的起始字节位置，为0则从头写入。
+        :param metrics: 所属任务的性能统计，写盘的耗时记在这里。
+        :param trace: 本次请求的 RequestTrace，分块读取不经过 aiohttp 的钩子，收到的字节数记在这里。
+
+        :returns: 实际的存储路径、文件的字节数和 SHA-256。
+        """
+        temppath = cls.__get_temp_path(url)
+        # 弱 ETag 不能用于 If-Range，不记录。
+        etag = response.headers.get('ETag')
+        if etag is not None and etag.startswith('W/'):
+            etag = None
+        await cls.__in_fs_pool(cls._journal.record, url, cls.__get_full_length(response, offset), etag)
+        # 边写边算哈希；续传时先把已有的部分算进去。
+        digest = hashlib.sha256()
+        if offset > 0:
+            await cls.__hash_file(temppath, digest)
+        async with aiofiles.open(temppath, 'ab' if offset > 0 else 'wb', executor=cls._fs_pool) as fw:
+            async for chunk in response.content.iter_chunked(cls.chunk_size):
+                digest.update(chunk)
+                trace.bytes += len(chunk)
+                # 全局限速，超过带宽上限就等一等再读下一块。
+                if cls._bandwidth is not None:
+                    await cls._bandwidth.consume(len(chunk))
+                start = time.monotonic()
+                await fw.write(chunk)
+                metrics.add_disk(start, wrote=True)
+        start = time.monotonic()
+        result = await cls.__in_fs_pool(cls.__finish_temp, url, filepath, digest)
+        metrics.add_disk(start)
+        return result
+
+    @classmethod
+    async def __hash_file(cls, path: str, digest):
+        """分块读取文件，更新哈希对象。
+
+        :param path: 文件路径。
+        :param digest: hashlib 的哈希对象。
+        """
+        async with aiofiles.open(path, 'rb', executor=cls._fs_pool) as fr:
+            while chunk := await fr.read(cls.chunk_size):
+                digest.update(chunk)
+
+    @classmethod
+    def __finish_temp(cls, url: str, filepath: str, digest) -> tuple[str, int, str]:
+        """把下载完成的临时文件按内容哈希存好，链接到存储路径，并删除日志记录。
+
+        如果已经存过内容相同的图片，就丢掉临时文件，直接链接已有的那份。
+        存储路径的扩展名按文件开头的魔数修正，文件内容原样保存，不做任何转换。
+        在文件系统线程池里执行。
+
+        :param url: 图片链接。
+        :param filepath: 存储路径。
+        :param digest: 已算完整个文件的哈希对象。
+
+        :returns: 实际的存储路径、文件的字节数和 SHA-256。
+        """
+        temppath = cls.__get_temp_path(url)
+        filepath = ImageType.fix_path(filepath, ImageType.from_file(temppath))
+        size = os.path.getsize(temppath)
+        hash = digest.hexdigest()
+        blobpath = cls.__get_blob_path(hash)
+        if os.path.exists(blobpath):
+            os.remove(temppath)
+        else:
+            try:
+                os.replace(temppath, blobpath)
+            # 子目录还没有（或输出目录在下载途中被误删了），创建后再移动。
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(blobpath), exist_ok=True)
+                os.replace(temppath, blobpath)
+        cls.__link_blob(blobpath, filepath)
+        cls._journal.discard(url)
+        return filepath, size, hash
+
+    @classmethod
+    def __get_blob_path(cls, hash: str) -> str:
+        """决定按内容存放的图片路径。
+
+        :param hash: 图片内容的 SHA-256。
+
+        :returns: 存放路径，按哈希的前2位分子目录，避免单个目录文件过多。
+        """
+        return os.path.join(cls.output_dir, cls.blob_dir, hash[:2], hash)
+
+    @classmethod
+    def __link_blob(cls, blobpath: str, filepath: str):
+        """让存储路径指向按内容存放的图片。
+
+        优先用硬链接；文件系统不支持时退而用符号链接，再不行就复制一份。
+        链接先建在临时目录里，再原子地移动到存储路径。
+
+        :param blobpath: 按内容存放的图片路径。
+        :param filepath: 存储路径，所在目录已经由任务事先创建好。
+        """
+        name = hashlib.sha1(filepath.encode()).hexdigest()
+        linkpath = os.path.join(cls.temp_dir, f'{name}.link')
+        if os.path.lexists(linkpath):
+            os.remove(linkpath)
+        try:
+            os.link(blobpath, linkpath)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(blobpath, os.path.dirname(filepath)), linkpath)
+            except OSError:
+                shutil.copyfile(blobpath, linkpath)
+        try:
+            os.replace(linkpath, filepath)
+        # 目录在下载途中被误删了，重新创建。
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            os.replace(linkpath, filepath)
+
+    @staticmethod
+    def __get_size(path: str) -> int:
+        """取得文件的字节数。
+
+        :param path: 文件路径。
+
+        :returns: 文件的字节数，文件不存在时为0。
+        """
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @classmethod
+    def __prepare_batch(cls, image_pairs: list[tuple], records: list[tuple],
+                        directories: set) -> tuple[set, list[tuple]]:
+        """为一批图片做好磁盘上的准备：创建还没建过的目录，找出已经下载过的图片。
+
+        索引里记录的文件还在就算下载过；文件被删了但按内容存放的那份还在，就重新链接到存储路径。
+        在文件系统线程池里执行，一批图片只切换一次线程，之后下载时不用再建目录。
+
+        :param image_pairs: (插画 ID, 分P序号, 链接, 路径, 动图帧列表)列表。
+        :param records: 与 image_pairs 对应的索引记录，没有记录的为 None。
+        :param directories: 任务已经创建好的目录，新建的目录会加进去。
+
+        :returns: 已经下载过的(插画 ID, 分P序号)集合，以及重新链接过、需要登记到索引的(插画 ID, 分P序号, 路径, 字节数, SHA-256)列表。
+        """
+        for directory in {cls.temp_dir, *(os.path.dirname(pair[3]) for pair in image_pairs)} - directories:
+            os.makedirs(directory, exist_ok=True)
+            directories.add(directory)
+        on_disk = set()
+        relinked = []
+        for (illust_id, page, _, filepath, _), record in zip(image_pairs, records):
+            if record is None:
+                continue
+            path, size, hash = record
+            if cls.__get_size(path) == size:
+                on_disk.add((illust_id, page))
+                continue
+            blobpath = cls.__get_blob_path(hash)
+            if cls.__get_size(blobpath) != size:
+                continue
+            cls.__link_blob(blobpath, filepath)
+            on_disk.add((illust_id, page))
+            relinked.append((illust_id, page, filepath, size, hash))
+        return on_disk, relinked
+
+    @classmethod
+    def __discard_temp(cls, url: str):
+        """删除无法续传的临时文件和日志记录。
+
+        :param url: 图片链接。
+        """
+        temppath = cls.__get_temp_path(url)
+        if os.path.exists(temppath):
+            os.remove(temppath)
+        cls._journal.discard(url)
+
+    @classmethod
+    def __update_bar(cls):
+        """按所有进行中任务的总进度更新进度条，并在标题里显示任务数和排队中的图片数。"""
+        supply = sum(job.supply for job in cls._jobs)
+        finished = sum(job.finished for job in cls._jobs)
+        # 如果设为0，进度条不会更新，所以至少设成0.1。
+        percent = max(finished / supply * 100, 0.1) if supply else 0.1
+        title = f'下载进度(并发{cls._scheduler.limit.limit} 排队{cls._scheduler.depth})'
+        if len(cls._jobs) > 1:
+            title = f'下载进度(任务{len(cls._jobs)} 并发{cls._scheduler.limit.limit} 排队{cls._scheduler.depth})'
+        cls._bar.title = title
         cls._bar.update(percent)
 
     @classmethod
-    def __get_image_pairs(cls, illust: dict) -> list[tuple[str, str]]:
+    def __get_image_pairs(cls, illust: dict, tier: str = 'original') -> list[tuple[str, str]]:
         """解析插画下载链接。
 
         从存储插画数据的字典中，解析出每张分P的图片路径（可直接下载）。
+        原图存放在输出目录下；预览图按尺寸存放在预览目录下，目录结构与原图相同。
 
         :param illust: 存储插画数据的字典。
+        :param tier: 图片尺寸，默认为原图。
 
         :returns: 元组列表，每个二元元组由图片链接、存储路径组成。
         """
@@ -192,62 +917,203 @@ class Pixiv:
         # 解析插画的标题。
         title = illust['title']
         # 去除题目中无法作为文件或文件夹名的字符。
-        title = re.sub('[\|/:*?"<>]', ' ', title)
-        # 如果该插画只有1P，那么图片链接会存储在"meta_single_page"字典里。
+        title = cls._unsafe_chars.sub(' ', title)
+        # 原图直接存储在输出目录下，预览图存储在对应尺寸的预览目录下。
+        base_dir = cls.output_dir
+        if tier != 'original':
+            base_dir = os.path.join(cls.output_dir, cls.preview_dir, tier)
+        # 动图的原图是装着各帧的 zip 包，图片名称为标题。
+        if 'ugoira_metadata' in illust:
+            zip_url = re.sub(r'ugoira\d+x\d+', f'ugoira{cls.ugoira_resolution}',
+                             illust['ugoira_metadata']['zip_urls']['medium'])
+            return [(cls.__to_local(zip_url), os.path.join(base_dir, f'{title}-{id}.zip'))]
+        # 预览图链接在"image_urls"字典里，键名随尺寸而定。
+        key = cls.size_tiers[tier]
+        # 如果该插画只有1P，那么原图链接会存储在"meta_single_page"字典里。
         if illust['page_count'] == 1:
             # 拿到可直接下载的图片链接。
-            image_url = cls.__to_local(
-                illust['meta_single_page']['original_image_url'])
-            # 直接存储在输出目录下，图片名称为标题。
-            filepath = os.path.join(cls.output_dir, f'{title}-{id}.png')
+            if tier == 'original':
+                image_url = illust['meta_single_page']['original_image_url']
+            else:
+                image_url = illust['image_urls'][key]
+            image_url = cls.__to_local(image_url)
+            # 图片名称为标题，扩展名随链接而定。
+            filepath = os.path.join(
+                base_dir, f'{title}-{id}{ImageType.from_url(image_url)}')
             # 保存至元组列表。
             image_pairs = [(image_url, filepath)]
         # 如果该插画不止1P，那么图片链接会存储在"meta_pages"字典里。
         else:
             # 拿到可直接下载的图片链接列表。
-            image_urls = [cls.__to_local(page['image_urls']['original'])
+            image_urls = [cls.__to_local(page['image_urls'][key])
                           for page in illust['meta_pages']]
-            # 创建二级输出目录，目录名为标题。
-            target_dir = os.path.join(cls.output_dir, f'{title}-{id}')
-            if not os.path.exists(target_dir):
-                os.mkdir(target_dir)
-            # 创建每张分P的存储路径列表，图片名称为分P序号。
+            # 二级输出目录，目录名为标题，由任务在下载前统一创建。
+            target_dir = os.path.join(base_dir, f'{title}-{id}')
+            # 创建每张分P的存储路径列表，图片名称为分P序号，扩展名随链接而定。
             filepaths = [os.path.join(
-                target_dir, f'{str(index+1).zfill(3)}.png') for index in range(len(image_urls))]
+                target_dir, f'{str(index+1).zfill(3)}{ImageType.from_url(image_url)}')
+                for index, image_url in enumerate(image_urls)]
             # 关联链接和路径。
             image_pairs = list(zip(image_urls, filepaths))
         # 返回元组列表。
         return image_pairs
 
     @classmethod
-    def __save(cls, illusts: list[dict]):
+    async def __fill_ugoira_metadata(cls, illusts: list[dict], tier: str):
+        """为一批插画里的动图同时请求帧信息，存进插画字典的 "ugoira_metadata" 里。
+
+        只有下载原图时才需要；预览图就是动图的第1帧，照普通插画下载。
+
+        :param illusts: 插画字典列表。
+        :param tier: 图片尺寸。
+        """
+        if tier != 'original':
+            return
+        ugoiras = [illust for illust in illusts if illust.get('type') == 'ugoira']
+        responses = await asyncio.gather(*[cls.__request(cls.api_url, params={
+            'type': 'ugoira_metadata',
+            'id': illust['id']
+        }) for illust in ugoiras])
+        for illust, data in zip(ugoiras, responses):
+            metadata = data.get('ugoira_metadata', {})
+            if len(metadata) != 0:
+                illust['ugoira_metadata'] = metadata
+
+    @classmethod
+    async def __save(cls, batches: AsyncIterator[list[dict]], not_found: str = None):
         """异步保存图片。
 
-        为每张图片注册下载任务并启动异步循环。
+        一边搜索插画，一边为已经拿到的图片注册下载任务。
 
-        :param illusts: 字典列表，每个字典都存储一组插画的数据。
+        :param batches: 异步迭代器，每次产出一批插画字典。
+        :param not_found: 一张图片都没有时给出的提示，为 None 时报错说找不到。
         """
-        # 解析字典，拿到链接列表。
-        image_pairs = [
-            pair for illust in illusts for pair in cls.__get_image_pairs(illust)]
-        # 如果一张图片都没有，就直接退出。
-        if len(image_pairs) == 0:
-            cls.__error('[错误] 找不到这幅图哦!')
+        job = current_job.get()
+        # 边搜索边下载。
+        found = await cls.__schedule(batches, job)
+        # 如果一张图片都没有，就报错。
+        if found == 0:
+            if not_found is None:
+                cls.__error(f'[错误] 找不到这幅图哦! ({job.name})')
+            else:
+                cls.__prompt(f'{not_found} ({job.name})')
+            return
+        # 如果全都下载过了，就提示一下。
+        if job.supply == 0:
+            cls.__prompt(f'这些图片都已经下载过(或正在下载)啦! ({job.name})')
             return
-        # 更新进度条。如果设为0，进度条不会更新，所以设成0.1。
-        cls._bar.update(0.1)
-        # 更新类变量。
-        cls._supply = len(image_pairs)
-        # 为每张图片注册下载任务。
-        tasks = [cls.__download_image(url, filepath)
-                 for (url, filepath) in image_pairs]
-        # 开始异步运行。
-        cls.__loop.run_until_complete(asyncio.wait(tasks))
-        # 全部下载完成后，准备下一轮。
-        cls.__clear()
-
-    @classmethod
-    def __search_by_id(cls, id: str):
+        # 从进度条处换行。
+        print('')
+        # 同时有别的任务时，说明是哪个任务完成了。
+        if len(cls._jobs) != 0:
+            cls.__prompt(f'[{job.name}] 下载完成: {job.downloaded}/{job.supply}')
+        # 报告下载失败的插画，方便之后重新下载。
+        if len(job.failures) != 0:
+            cls.__report_failures(job)
+
+    @classmethod
+    def __report_failures(cls, job: Job):
+        """汇总报告一个任务里下载失败的插画。
+
+        :param job: 下载任务。
+        """
+        for illust_id, page, e in job.failures:
+            cls.__error(f'[错误] 插画[{illust_id}]的第{page + 1}P下载失败: {e}')
+        illust_ids = sorted({int(illust_id) for illust_id, _, _ in job.failures})
+        cls.__warning(f'[提示] 有{len(illust_ids)}幅插画没下载完整，'
+                      f'可以稍后用 id 指令重新下载: {" ".join(map(str, illust_ids))}')
+
+    @classmethod
+    async def __schedule(cls, batches: AsyncIterator[list[dict]], job: Job) -> int:
+        """用调度器下载图片。
+
+        每拿到一批插画，就立即把它的图片交给共用的调度器，不必等搜索全部结束。
+        同时进行的任务轮流使用调度器的并发额度，额度随网络状况自动调整；每个主机限速，各插画的第1P优先于后面的分P下载。
+
+        :param batches: 异步迭代器，每次产出一批插画字典。
+        :param job: 这些图片所属的任务。
+
+        :returns: 找到的图片数。实际需要下载的图片数记在任务里。
+        """
+        cls._scheduler.start()
+        cls._scheduler.open(job)
+        cls._jobs.append(job)
+        found = 0
+        try:
+            async for illusts in batches:
+                # 保存元数据，之后可以直接在本地查询。
+                cls._metadata.add(illusts)
+                # 下载原图时，动图要先请求帧信息才知道 zip 包的链接。先只占个位（链接和路径为 None），
+                # 确定没下载过再请求，已经下载过的动图不花网络请求。
+                ugoiras = {illust['id']: illust for illust in illusts
+                           if job.tier == 'original' and illust.get('type') == 'ugoira'
+                           and illust.get('visible') and 'ugoira_metadata' not in illust}
+                # 解析字典，拿到(插画 ID, 分P序号, 链接, 路径, 动图帧列表)列表。
+                image_pairs = []
+                for illust in illusts:
+                    # 插画不存在或请求失败时是空字典。
+                    if len(illust) == 0:
+                        continue
+                    if illust['id'] in ugoiras:
+                        image_pairs.append((illust['id'], 0, None, None, None))
+                        continue
+                    frames = illust.get('ugoira_metadata', {}).get('frames')
+                    image_pairs.extend((illust['id'], page, url, filepath, frames)
+                                       for page, (url, filepath) in enumerate(cls.__get_image_pairs(illust, job.tier)))
+                found += len(image_pairs)
+                # 按插画 ID 和尺寸去重：跳过本进程里已经安排过的。先占住，免得等待磁盘时别的任务也安排了同样的图片。
+                image_pairs = [pair for pair in image_pairs
+                               if (pair[0], pair[1], job.tier) not in cls._scheduled]
+                if len(image_pairs) == 0:
+                    continue
+                claimed = {(pair[0], pair[1], job.tier) for pair in image_pairs}
+                cls._scheduled.update(claimed)
+                try:
+                    # 查索引（SQLite 连接只能在异步循环的线程里用），再到文件系统线程池里建好这批图片的目录，
+                    # 并跳过已经下载过的图片。占位的动图按索引里记录的路径检查，没有记录的一定要下载。
+                    records = [cls._index.lookup(pair[0], pair[1], job.tier) for pair in image_pairs]
+                    image_pairs = [(*pair[:3], record[0], None) if pair[3] is None and record is not None else pair
+                                   for pair, record in zip(image_pairs, records)]
+                    checked = [(pair, record) for pair, record in zip(image_pairs, records) if pair[3] is not None]
+                    on_disk, relinked = await cls.__in_fs_pool(
+                        cls.__prepare_batch, [pair for pair, _ in checked], [record for _, record in checked],
+                        job.directories)
+                    image_pairs = [pair for pair in image_pairs if (pair[0], pair[1]) not in on_disk]
+                    # 剩下的动图才请求帧信息，换成 zip 包的链接和路径。
+                    missing = [ugoiras[pair[0]] for pair in image_pairs if pair[2] is None]
+                    if len(missing) != 0:
+                        await cls.__fill_ugoira_metadata(missing, job.tier)
+                        zips = [(illust['id'], 0, url, filepath, illust.get('ugoira_metadata', {}).get('frames'))
+                                for illust in missing for url, filepath in cls.__get_image_pairs(illust, job.tier)]
+                        await cls.__in_fs_pool(cls.__prepare_batch, zips, [None] * len(zips), job.directories)
+                        image_pairs = [pair for pair in image_pairs if pair[2] is not None] + zips
+                except BaseException:
+                    cls._scheduled.difference_update(claimed)
+                    raise
+                for record in relinked:
+                    cls._index.add(*record, tier=job.tier)
+                cls._scheduled.difference_update((*key, job.tier) for key in on_disk)
+                if len(image_pairs) == 0:
+                    continue
+                # 更新任务进度。
+                job.supply += len(image_pairs)
+                cls.__update_bar()
+                # 先按分P序号排序提交，队列满时在此等待。
+                for illust_id, page, url, filepath, frames in sorted(image_pairs, key=lambda pair: pair[1]):
+                    await cls._scheduler.submit(job, page, url, filepath, illust_id, page, job, frames)
+        finally:
+            # 搜索中途出错时，也等已经提交的图片下载完，再撤掉任务的队列，不在调度器里留下状态。
+            try:
+                failures = await cls._scheduler.join(job)
+            finally:
+                cls._jobs.remove(job)
+            # 调度器里意外出错的活也算下载失败。
+            for (_, _, illust_id, page, *_), e in failures:
+                job.failures.append((illust_id, page, e))
+        return found
+
+    @classmethod
+    async def __search_by_id(cls, id: str):
         """根据插画 ID 下载图片。
 
         :param id: 插画 ID。
@@ -256,22 +1122,70 @@ class Pixiv:
         if re.fullmatch('\d{1,10}', id) is None:
             cls.__error('[错误] ID不合法哦!')
             return
+        # 调用存储函数。
+        await cls.__save(cls.__iter_id_illusts(id))
+
+    @classmethod
+    async def __iter_id_illusts(cls, id: str) -> AsyncIterator[list[dict]]:
+        """请求单幅插画的数据。
+
+        :param id: 插画 ID。
+
+        :returns: 异步迭代器，产出一个（一元）插画字典列表。
+        """
         # 插画的数据在下面这个字典（一元）列表里。
-        illusts = [cls.__request(cls.api_url, params={
+        yield [(await cls.__request(cls.api_url, params={
             'type': 'illust',
             'id': id
-        }).json().get('illust', {})]
+        })).get('illust', {})]
+
+    @classmethod
+    async def __search_by_ids(cls, ids: list):
+        """根据多个插画 ID 下载图片。
+
+        用于把先前只下载了预览图的插画换成原图（或其他尺寸）。已经下载过的图片会直接跳过。
+
+        :param ids: 插画 ID 列表。
+        """
+        # 验证 ID 合法性。
+        for id in ids:
+            if re.fullmatch(r'\d{1,10}', id) is None:
+                cls.__error(f'[错误] ID[{id}]不合法哦!')
+                return
+        # 去掉重复的 ID，保持原来的顺序。
+        ids = list(dict.fromkeys(ids))
         # 调用存储函数。
-        cls.__save(illusts)
+        await cls.__save(cls.__iter_ids_illusts(ids))
 
     @classmethod
-    def __search_by_member(cls, id: str, quantity: str):
+    async def __iter_ids_illusts(cls, ids: list) -> AsyncIterator[list[dict]]:
+        """同时请求多幅插画的数据，按给出的顺序逐幅产出。
+
+        :param ids: 插画 ID 列表。
+
+        :returns: 异步迭代器，每次产出一个（一元）插画字典列表。
+        """
+        tasks = cls.__request_pages([{
+            'type': 'illust',
+            'id': id
+        } for id in ids])
+        try:
+            for task in tasks:
+                illust = (await task).get('illust', {})
+                if len(illust) != 0:
+                    yield [illust]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @classmethod
+    async def __search_by_member(cls, id: str, quantity: str):
         """根据画师 ID 下载图片。
 
         搜索指定画师的最新图片。可指定下载张数，默认下载最新5张。
 
         :param id: 画师 ID。
-        :param quantity: 下载图片数量，默认为5，区间在[1, 100]。
+        :param quantity: 下载图片数量，至少为1，为 "all" 时不限。
         """
         # 验证 ID 合法性。
         if re.fullmatch('\d{1,10}', id) is None:
@@ -283,10 +1197,10 @@ class Pixiv:
         if page_num == 0:
             return
         # 画师信息在这个字典里。
-        illustrator = cls.__request(cls.api_url, params={
+        illustrator = (await cls.__request(cls.api_url, params={
             'type': 'member',
             'id': id
-        }).json().get('user', {})
+        })).get('user', {})
         # 如果不存在该画师，报错。
         if illustrator == {}:
             cls.__error(f'[错误] 找不到[{id}]这位画师诶?')
@@ -294,36 +1208,132 @@ class Pixiv:
         # 获取画师名字。
         name = illustrator.get('name', 'Not found')
         cls.__prompt(f'这位画师叫: {name}')
-        # 每幅插画的数据将存储在下面这个字典列表里。
-        illusts = []
-        # 依次爬取每一页。
-        for page in range(page_num):
-            # 该页所有插画的列表。
-            cur_page_illusts = cls.__request(cls.api_url, params={
+        # 调用存储函数。
+        await cls.__save(cls.__iter_member_illusts(id, quantity, page_num))
+
+    @classmethod
+    async def __iter_member_illusts(cls, id: str, quantity: float, page_num: float) -> AsyncIterator[list[dict]]:
+        """翻页请求画师作品，逐页产出插画列表。
+
+        :param id: 画师 ID。
+        :param quantity: 需求数量，可以是无穷大。
+        :param page_num: 需要爬取的页数，可以是无穷大。
+
+        :returns: 异步迭代器，每次产出一页里需要的插画。
+        """
+        # 拿到的插画数。
+        at_hand = 0
+        async for illusts in cls.__iter_pages(lambda page: {
+            'type': 'member_illust',
+            'id': id,
+            'page': page
+        }, quantity, page_num):
+            at_hand += len(illusts)
+            yield illusts
+        # 如果拿到了，但是插画数量不达标，给出警告。
+        if 0 < at_hand < quantity != math.inf:
+            cls.__warning(
+                f'\r[提示] 我只找到了{at_hand}幅插画...')
+
+    @classmethod
+    async def __follow(cls, ids: list):
+        """增量同步关注的画师，只下载上次同步之后的新作品。
+
+        从最新的作品往前翻页，碰到水位线（上次看过的最大插画 ID）就停下。
+        第一次同步的画师只下载最新的若干幅。下载完成后，水位线推进到连续下载成功的最大插画 ID，
+        所以失败的作品下次同步还会再试。
+
+        :param ids: 画师 ID 列表，为空时同步所有关注的画师。
+        """
+        # 验证 ID 合法性。
+        for id in ids:
+            if re.fullmatch(r'\d{1,10}', id) is None:
+                cls.__error(f'[错误] ID[{id}]不合法哦!')
+                return
+        for id in ids:
+            cls._watchlist.add(id)
+        if len(ids) == 0:
+            ids = cls._watchlist.members
+        if len(ids) == 0:
+            cls.__warning('[提示] 还没有关注任何画师，试试 follow [画师ID]?')
+            return
+        job = current_job.get()
+        # 每位画师的新作品 ID，翻页没有出错的画师才在这里。
+        new_ids = {}
+        await cls.__save(cls.__iter_follow_illusts(list(dict.fromkeys(ids)), new_ids),
+                         not_found='关注的画师都没有新作品')
+        # 推进水位线，遇到下载失败的作品就停下。
+        failed = {int(illust_id) for illust_id, _, _ in job.failures}
+        for id, illust_ids in new_ids.items():
+            watermark = cls._watchlist.get(id)
+            for illust_id in sorted(illust_ids):
+                if illust_id in failed:
+                    break
+                watermark = illust_id
+            cls._watchlist.update(id, watermark)
+
+    @classmethod
+    async def __iter_follow_illusts(cls, ids: list, new_ids: dict) -> AsyncIterator[list[dict]]:
+        """逐位画师往前翻页，产出水位线以上的新作品。
+
+        同时请求一个滑动窗口内若干位画师的第1页；大多数画师只有第1页里有新作品，不用再往下翻。
+
+        :param ids: 画师 ID 列表。
+        :param new_ids: 用于返回每位画师的新作品 ID 列表，翻页出错的画师不会出现在里面。
+
+        :returns: 异步迭代器，每次产出一页里的新作品。
+        """
+        def request(id: str, page: int) -> asyncio.Task:
+            return asyncio.ensure_future(cls.__request(cls.api_url, params={
                 'type': 'member_illust',
                 'id': id,
                 'page': page
-            }).json().get('illusts', [])
-            # 如果该页没有插画，说明接下来也不会有了。
-            if len(cur_page_illusts) == 0:
-                break
-            # 确定想要从这一页下载几幅插画。
-            # - 需求还剩几张？
-            # - 该页还剩几张？
-            # 从这两个数中选最小的。
-            desire_len = min(quantity - page *
-                             cls.page_quantity, len(cur_page_illusts))
-            # 将对应数量的插画加入列表。
-            illusts.extend(cur_page_illusts[:desire_len])
-        # 如果拿到了，但是插画数量不达标，给出警告。
-        if 0 < len(illusts) < quantity:
-            cls.__warning(
-                f'[提示] 我只找到了{len(illusts)}幅插画...')
-        # 调用存储函数。
-        cls.__save(illusts)
+            }))
+        window = cls.search_window
+        # 先发出窗口内各位画师第1页的请求。
+        tasks = deque(request(id, 0) for id in ids[:window])
+        try:
+            for index, id in enumerate(ids):
+                task = tasks.popleft()
+                # 窗口向后滑动一位画师。
+                if index + window < len(ids):
+                    tasks.append(request(ids[index + window], 0))
+                watermark = cls._watchlist.get(id)
+                illust_ids = []
+                page = 0
+                while True:
+                    data = await task
+                    # 请求失败就跳过这位画师，不推进水位线，免得漏掉作品。
+                    if 'illusts' not in data:
+                        illust_ids = None
+                        break
+                    illusts = data['illusts']
+                    # 比水位线大的才是新作品。
+                    fresh = [illust for illust in illusts
+                             if watermark is None or int(illust['id']) > watermark]
+                    # 第一次同步只要最新的若干幅。
+                    if watermark is None:
+                        fresh = fresh[:cls.follow_initial - len(illust_ids)]
+                    illust_ids.extend(int(illust['id']) for illust in fresh)
+                    if len(fresh) != 0:
+                        yield fresh
+                    # 碰到看过的作品、数量已够或者翻到了最后一页，就不再往下翻。
+                    if (len(fresh) < len(illusts) or len(illusts) < cls.page_quantity
+                            or watermark is None and len(illust_ids) >= cls.follow_initial):
+                        break
+                    page += 1
+                    task = request(id, page)
+                if illust_ids is not None:
+                    new_ids[id] = illust_ids
+                    if len(illust_ids) != 0:
+                        cls.__prompt(f'\r画师[{id}]有{len(illust_ids)}幅新作品')
+        finally:
+            # 取消窗口里剩下的请求。
+            for task in tasks:
+                task.cancel()
 
     @classmethod
-    def __search_by_rank(cls, mode: str = 'day', quantity: str = '30'):
+    async def __search_by_rank(cls, mode: str = 'day', quantity: str = '30'):
         """按排行榜下载。
 
         下载指定日期、指定排行榜榜顶的指定数量的插画。默认下载日榜前30张。
@@ -337,151 +1347,414 @@ class Pixiv:
             - "original" ---- 原创作品榜
             - "rookie" ------ 新人榜
             - "manga" ------- 漫画日榜
-        :param quantity: 下载图片数量，默认为30，区间在[1, 100]。
+        :param quantity: 下载图片数量，默认为30，为 "all" 时不限。
         """
-        # 判断模式是否合法。
-        if mode not in cls.rank_modes:
+        # 判断模式是否合法，并修正模式。
+        mode = cls.__fix_mode(mode)
+        if mode is None:
             cls.__error('[错误] 模式不合法哦!')
             return
-        # 修正模式。
+        # 确定爬取页面数。
+        quantity, page_num = cls.__get_page_num(quantity)
+        # 如果不需要爬，就提前退出。
+        if page_num == 0:
+            return
+        # 调用存储函数。
+        await cls.__save(cls.__iter_rank_illusts(mode, quantity, page_num))
+
+    @classmethod
+    def __fix_mode(cls, mode: str) -> str:
+        """把排行模式修正为 API 使用的名字。
+
+        :param mode: 排行模式，也可以直接写 API 使用的名字，如 "week_original"。
+
+        :returns: 修正后的排行模式，不合法则返回 None。
+        """
         if mode in ('male', 'female', 'manga'):
-            mode = f'day_{mode}'
+            return f'day_{mode}'
         elif mode in ('original', 'rookie'):
-            mode = f'week_{mode}'
+            return f'week_{mode}'
+        elif mode in ('day', 'week', 'month'):
+            return mode
+        # 已经修正过的名字原样返回。
+        elif mode in [cls.__fix_mode(name) for name in cls.rank_modes]:
+            return mode
+        return None
+
+    @classmethod
+    async def __search_by_archive(cls, start: str, end: str, modes: list, quantity: str = '30'):
+        """归档一段日期里的排行榜。
+
+        同时爬取日期范围内每一天、每种模式的排行榜。往日的排行榜会永久缓存，重复归档不用再请求；
+        同一幅插画连续几天上榜也只下载一次，所以流量只与不同插画的数量有关。
+
+        :param start: 起始日期，格式为 "YYYY-MM-DD"。
+        :param end: 结束日期（含），格式同上，晚于今天时按今天算。
+        :param modes: 排行模式列表。
+        :param quantity: 每个排行榜下载的图片数量，默认为30，为 "all" 时不限。
+        """
+        # 验证日期合法性。
+        try:
+            start_date = datetime.strptime(start, '%Y-%m-%d')
+            end_date = min(datetime.strptime(end, '%Y-%m-%d'), datetime.now())
+        except ValueError:
+            cls.__error('[错误] 日期不合法哦! 格式是YYYY-MM-DD')
+            return
+        if start_date > end_date:
+            cls.__error('[错误] 起始日期不能晚于结束日期哦!')
+            return
+        # 判断模式是否合法，并修正模式。
+        fixed_modes = [cls.__fix_mode(mode) for mode in modes]
+        if None in fixed_modes:
+            cls.__error('[错误] 模式不合法哦!')
+            return
         # 确定爬取页面数。
         quantity, page_num = cls.__get_page_num(quantity)
-        # 如果不需要爬，就提前退出。
         if page_num == 0:
             return
-        # 将每幅插画的字典放入列表。
-        illusts = []
-        for day_delta in range(3):
-            # 指定日期。
-            date = (datetime.now() - timedelta(days=day_delta)).strftime("%F")
-            # 对每页发起请求。
-            for page in range(page_num):
-                # 拿到该页所有插画的列表。
-                cur_page_illusts = cls.__request(cls.api_url, params={
-                    'type': 'rank',
-                    'page': page,
-                    'mode': mode,
-                    'date': date
-                }).json().get('illusts', [])
-                # 该页插画数量。
-                cur_page_len = len(cur_page_illusts)
-                # 如果该页没有插画，说明接下来也不会有了。
-                if cur_page_len == 0:
-                    break
-                # 确定想要从这一页下载几幅插画。
-                # - 需求还剩几张？
-                # - 该页还剩几张？
-                # 从这两个数中选最小的。
-                desire_len = min(
-                    quantity - page*cls.page_quantity, cur_page_len)
-                # 将对应数量的插画加入列表。
-                illusts.extend(cur_page_illusts[:desire_len])
-            # 如果拿到了，就不用继续循环了。
-            if len(illusts) != 0:
-                break
+        # 每个(模式, 日期)是一个排行榜。
+        rankings = [(mode, (start_date + timedelta(days=day_delta)).strftime('%F'))
+                    for day_delta in range((end_date - start_date).days + 1)
+                    for mode in dict.fromkeys(fixed_modes)]
         # 调用存储函数。
-        cls.__save(illusts)
+        await cls.__save(cls.__iter_archive_illusts(rankings, quantity, page_num))
 
     @classmethod
-    def __search_by_tag(cls, tags: list, quantity: str, popularity: int = 0):
+    async def __iter_archive_illusts(cls, rankings: list[tuple[str, str]], quantity: float, page_num: float) -> AsyncIterator[list[dict]]:
+        """同时爬取多个排行榜，去重后逐页产出插画列表。
+
+        若干个爬取协程轮流认领排行榜，各自翻页，把拿到的页放进一个有界队列；
+        下载跟不上时队列会满，爬取协程随之暂停。
+
+        :param rankings: 排行榜列表，元素为(修正后的排行模式, 日期)。
+        :param quantity: 每个排行榜的需求数量，可以是无穷大。
+        :param page_num: 每个排行榜需要爬取的页数，可以是无穷大。
+
+        :returns: 异步迭代器，每次产出一页里之前没出现过的插画。
+        """
+        queue = asyncio.Queue(maxsize=cls.search_window)
+        pending = iter(rankings)
+
+        async def crawl():
+            try:
+                for mode, date in pending:
+                    async for illusts in cls.__iter_pages(lambda page, mode=mode, date=date: {
+                        'type': 'rank',
+                        'page': page,
+                        'mode': mode,
+                        'date': date
+                    }, quantity, page_num):
+                        await queue.put(illusts)
+            except Exception as e:
+                cls.__error(f'[错误] {e}')
+            # 用 None 表示这个爬取协程结束了。
+            await queue.put(None)
+        crawlers = [asyncio.ensure_future(crawl())
+                    for _ in range(min(cls.archive_concurrency, len(rankings)))]
+        # 已经产出过的插画 ID。
+        seen = set()
+        try:
+            running = len(crawlers)
+            while running != 0:
+                illusts = await queue.get()
+                if illusts is None:
+                    running -= 1
+                    continue
+                # 连续几天上榜的插画只要一次。
+                illusts = [illust for illust in illusts if illust['id'] not in seen]
+                seen.update(illust['id'] for illust in illusts)
+                if len(illusts) != 0:
+                    yield illusts
+        finally:
+            for crawler in crawlers:
+                crawler.cancel()
+        cls.__prompt(f'\r{len(rankings)}个排行榜里共有{len(seen)}幅不同的插画')
+
+    @classmethod
+    async def __iter_rank_illusts(cls, mode: str, quantity: float, page_num: float) -> AsyncIterator[list[dict]]:
+        """找到最近一天有数据的排行榜，翻页请求，逐页产出插画列表。
+
+        :param mode: 修正后的排行模式。
+        :param quantity: 需求数量，可以是无穷大。
+        :param page_num: 需要爬取的页数，可以是无穷大。
+
+        :returns: 异步迭代器，每次产出一页里需要的插画。
+        """
+        # 最近3天的日期。
+        dates = [(datetime.now() - timedelta(days=day_delta)).strftime("%F")
+                 for day_delta in range(3)]
+        # 同时请求3天的第1页，按日期从近到远挑出第一个有插画的。
+        first_pages = cls.__request_pages([{
+            'type': 'rank',
+            'page': 0,
+            'mode': mode,
+            'date': date
+        } for date in dates])
+        try:
+            for date, first_page in zip(dates, first_pages):
+                if len((await first_page).get('illusts', [])) != 0:
+                    break
+            # 3天都没有，就不用继续了。
+            else:
+                return
+        finally:
+            for task in first_pages:
+                if task is not first_page:
+                    task.cancel()
+        # 第1页已经拿到，接着翻页。
+        async for illusts in cls.__iter_pages(lambda page: {
+            'type': 'rank',
+            'page': page,
+            'mode': mode,
+            'date': date
+        }, quantity, page_num, first=first_page):
+            yield illusts
+
+    @classmethod
+    async def __search_by_tag(cls, tags: list, quantity: str, popularity: int = 0):
         """按标签下载。
 
         搜索指定的多个标签、指定数量、指定人气的插画。
 
         :param tags: 标签组列表。
-        :param quantity: 需求数量，区间为[1, 100]。
+        :param quantity: 需求数量，至少为1，为 "all" 时不限。
         :param popularity: 人气最低值，默认为0。
         """
         # 检验数量合法性。
         quantity, _ = cls.__get_page_num(quantity)
         if _ == 0:
             return
+        # 调用存储函数。
+        await cls.__save(cls.__iter_tag_illusts(tags, quantity, popularity))
+
+    @classmethod
+    def __get_tag_index(cls) -> TagIndex:
+        """取得标签倒排索引，元数据有更新时重建。
+
+        :returns: 标签倒排索引。
+        """
+        if cls._tag_index is None or cls._tag_index_version != cls._metadata.version:
+            cls._tag_index = TagIndex(cls._metadata.iter_postings(),
+                                      cls._metadata.get_bookmarks())
+            cls._tag_index_version = cls._metadata.version
+        return cls._tag_index
+
+    @classmethod
+    async def __search_by_local_tag(cls, tags: list, quantity: str, popularity: int = 0):
+        """在本地保存的元数据里按标签搜索，然后下载。
+
+        标签和人气的筛选全在倒排索引上完成，不请求 API；已经下载过的图片照常跳过，
+        只有还没下载的图片才需要请求网络。
+
+        :param tags: 标签组列表。
+        :param quantity: 需求数量，至少为1，为 "all" 时不限。
+        :param popularity: 人气最低值，默认为0。
+        """
+        # 至少要有1个标签。
+        if len(tags) == 0:
+            cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+            return
+        # 检验数量合法性。
+        quantity, _ = cls.__get_page_num(quantity)
+        if _ == 0:
+            return
+        # 与在线搜索一样，没要 R-18 就排除掉 R-18 插画。
+        ids = cls.__get_tag_index().search(
+            tags, popularity, exclude=[] if 'R-18' in tags else ['R-18'])
+        if quantity != math.inf:
+            ids = ids[:quantity]
+        if 0 < len(ids) < quantity != math.inf:
+            cls.__warning(f'[提示] 本地只找到了{len(ids)}幅插画...')
+        # 调用存储函数。
+        await cls.__save(cls.__iter_local_illusts(ids))
+
+    @classmethod
+    async def __iter_local_illusts(cls, ids: list[int]) -> AsyncIterator[list[dict]]:
+        """从元数据库里逐页取出插画字典。
+
+        :param ids: 插画 ID 列表。
+
+        :returns: 异步迭代器，每次产出一页插画字典。
+        """
+        for start in range(0, len(ids), cls.page_quantity):
+            yield cls._metadata.get(ids[start:start + cls.page_quantity])
+
+    @classmethod
+    async def __iter_tag_illusts(cls, tags: list, quantity: int, popularity: int) -> AsyncIterator[list[dict]]:
+        """按标签搜索，逐页产出插画列表。
+
+        :param tags: 标签组列表。
+        :param quantity: 需求数量。
+        :param popularity: 人气最低值。
+
+        :returns: 异步迭代器，每次产出一页里符合要求的插画。
+        """
         # 检查是否需要 R-18 图片。
         is_r18 = True if 'R-18' in tags else False
         # 修正标签。
         tags = ' '.join(tags)
+        # 拿到的插画数。
+        at_hand = 0
         # 用"users入り"方法先找一遍。
-        illusts = cls.__get_illusts_by_tags(
-            f'{tags} {popularity}users入り', quantity, is_r18=is_r18, is_traverse=False)
+        async for illusts in cls.__get_illusts_by_tags(
+                f'{tags} {popularity}users入り', quantity, is_r18=is_r18, is_traverse=False):
+            at_hand += len(illusts)
+            yield illusts
         # 如果没拿到，就转用遍历法搜索。
-        if len(illusts) == 0:
-            illusts = cls.__get_illusts_by_tags(
-                tags, quantity, is_r18=is_r18, is_traverse=True, popularity=popularity)
+        if at_hand == 0:
+            async for illusts in cls.__get_illusts_by_tags(
+                    tags, quantity, is_r18=is_r18, is_traverse=True, popularity=popularity):
+                at_hand += len(illusts)
+                yield illusts
         # 如果拿到了，但是插画数不足，就给出警告。
-        if 0 < len(illusts) < quantity:
+        if 0 < at_hand < quantity != math.inf:
             cls.__warning(
-                f'\r[提示] 我只找到了{len(illusts)}幅插画...')
-        # 调用存储函数。
-        cls.__save(illusts)
+                f'\r[提示] 我只找到了{at_hand}幅插画...')
 
     @classmethod
-    def __get_illusts_by_tags(cls, tags: str, quantity: int, is_r18: bool, is_traverse: bool, popularity: int = 0) -> list[dict]:
+    async def __get_illusts_by_tags(cls, tags: str, quantity: int, is_r18: bool, is_traverse: bool, popularity: int = 0) -> AsyncIterator[list[dict]]:
         """为按标签搜索的函数找到插画列表。
 
         搜索指定的多个标签、指定数量、指定人气的插画。
+        同时请求一个滑动窗口内的若干页，按页码顺序逐页筛选；
+        数量达标或搜到最后一页时，取消窗口里剩下的请求，所以最多浪费"窗口大小-1"次请求。
 
         :param tags: 标签字符串。
-        :param quantity: 需求数量，区间为[1, 100]。
+        :param quantity: 需求数量，可以是无穷大。
         :param is_r18: 是否需要 R-18 图片。
         :param is_traverse: 是否按照遍历法搜索。
         :param popularity: 人气最低值，默认为0。
 
-        :returns: 插画字典列表。
+        :returns: 异步迭代器，每次产出一页里符合要求的插画。
         """
-        # 存储插画字典的列表。
-        illusts = []
+        def request(page: int) -> asyncio.Task:
+            return asyncio.ensure_future(cls.__request(cls.api_url, params={
+                'type': 'search',
+                'word': tags,
+                'page': page,
+                'mode': 'partial_match_for_tags'
+            }))
+        # 遍历法要筛人气，需要的页数无法预估，窗口开满；否则按需求数量估计页数。
+        window = cls.search_window
+        if not is_traverse and quantity != math.inf:
+            window = min(window, (quantity - 1) // cls.page_quantity + 1)
+        # 先发出窗口内各页的请求。
+        tasks = deque(request(page) for page in range(window))
         # 依次向各页发送请求，寻找人气高于指定值的插画链接，直到达到指定数量。
         at_hand = 0
         cur_page = 0
         quit = False
-        while not quit:
-            cls.__prompt(
-                f'\r正在第{cur_page}页里查找...', end='', flush=True)
-            # 该页所有插画的列表。
-            cur_page_illusts = cls.__request(cls.api_url, params={
-                'type': 'search',
-                'word': tags,
-                'page': cur_page,
-                'mode': 'partial_match_for_tags'
-            }).json().get('illusts', [])
-            # 如果当前页的插画数已不足需求，就提前退出。
-            if len(cur_page_illusts) < min(quantity - at_hand, cls.page_quantity):
-                quit = True
-            # 检查每幅插画的人气。
-            for illust in cur_page_illusts:
-                # 如果 R-18 与需求不一致，就检查下一幅。
-                if ('R-18' in [tags['name'] for tags in illust['tags']]) ^ is_r18:
-                    continue
-                # 如果我需要一张张检查人气，并且人气不达标，也检查下一幅。
-                if is_traverse and (illust['total_bookmarks'] < popularity):
-                    continue
-                # 如果与需求一致，就加入列表。
-                illusts.append(illust)
-                at_hand += 1
-                # 如果数量达标，就退出循环。
-                if at_hand == quantity:
+        try:
+            while not quit:
+                cls.__prompt(
+                    f'\r正在第{cur_page}页里查找...', end='', flush=True)
+                # 该页所有插画的列表。
+                cur_page_illusts = (await tasks.popleft()).get('illusts', [])
+                # 如果当前页的插画数已不足需求，就提前退出。
+                if len(cur_page_illusts) < min(quantity - at_hand, cls.page_quantity):
                     quit = True
-                    break
-            # 进入下一页。
-            cur_page += 1
-        # 返回插画列表。
-        return illusts
+                # 该页符合要求的插画。
+                illusts = []
+                # 检查每幅插画的人气。
+                for illust in cur_page_illusts:
+                    # 如果 R-18 与需求不一致，就检查下一幅。
+                    if ('R-18' in [tags['name'] for tags in illust['tags']]) ^ is_r18:
+                        continue
+                    # 如果我需要一张张检查人气，并且人气不达标，也检查下一幅。
+                    if is_traverse and (illust['total_bookmarks'] < popularity):
+                        continue
+                    # 如果与需求一致，就加入列表。
+                    illusts.append(illust)
+                    at_hand += 1
+                    # 如果数量达标，就退出循环。
+                    if at_hand == quantity:
+                        quit = True
+                        break
+                # 这一页的插画马上就可以开始下载。
+                if len(illusts) != 0:
+                    yield illusts
+                # 进入下一页，窗口向后滑动一页。
+                if not quit:
+                    tasks.append(request(cur_page + window))
+                cur_page += 1
+        finally:
+            # 取消窗口里剩下的请求。
+            for task in tasks:
+                task.cancel()
 
     @classmethod
-    def __clear(cls):
-        """清空与进度条相关的变量，准备下一轮。"""
-        cls._supply = 0
-        cls._downloaded = 0
-        # 从进度条处换行。
-        print('')
+    def __run(cls, function: str, args: list, coroutine: Awaitable, tier: str = None):
+        """把一条指令的协程作为一个任务执行。
+
+        平时立即执行到结束；批处理时只创建任务，由 run_batch 统一并发执行。
+
+        :param function: 功能名。
+        :param args: 指令参数列表。
+        :param coroutine: 执行指令的协程。
+        :param tier: 该功能默认下载的尺寸，为 None 时按全局的默认尺寸。指令里指定的尺寸优先。
+        """
+        tier = cls._tier or tier or cls.default_tier
+        job = Job(' '.join([function, *args]), cls.__new_retry(), tier)
+        task = cls.__loop.create_task(cls.__run_job(job, coroutine))
+        if cls._batch is not None:
+            cls._batch.append(task)
+        else:
+            cls.__loop.run_until_complete(task)
+
+    @classmethod
+    async def __run_job(cls, job: Job, coroutine: Awaitable):
+        """在任务自己的上下文里执行协程，结束后报告性能统计。
+
+        任务出错只报告错误，不影响同时进行的其他任务，也不会让交互模式退出。
+
+        :param job: 下载任务。
+        :param coroutine: 执行指令的协程。
+        """
+        current_job.set(job)
+        try:
+            await coroutine
+        except Exception as e:
+            cls.__error(f'[错误] 任务出错了: {e!r} ({job.name})')
+        finally:
+            cls.__report_metrics(job)
+
+    @classmethod
+    def __report_metrics(cls, job: Job):
+        """显示一个任务的性能统计，需要时导出到文件。
+
+        :param job: 下载任务。
+        """
+        summary = job.metrics.summary(job.retry.retries)
+        # 既没发请求也没用缓存的（比如指令有误），不用报告。
+        if summary['cache_hits'] == 0 and all(
+                stats['count'] == 0 for stats in summary['requests'].values()):
+            return
+        cls.__prompt(f'[统计] {Metrics.format(summary)} ({job.name})')
+        if cls.metrics_path is not None:
+            cls._summaries[job.name] = summary
+            Metrics.export(cls.metrics_path, job.name, summary, cls._summaries)
 
     @classmethod
     def __quit(cls):
         """退出应用。"""
+        # 关闭索引、元数据库和缓存。
+        cls._index.close()
+        cls._metadata.close()
+        cls._cache.close()
+        # 停止调度器。
+        cls.__loop.run_until_complete(cls._scheduler.close())
+        # 等合成中的动图完成，关闭进程池。
+        if cls._pool is not None:
+            cls._pool.shutdown()
+        # 停止地址池的健康检查。
+        if cls._health is not None:
+            cls._health.cancel()
+            cls.__loop.run_until_complete(asyncio.gather(cls._health, return_exceptions=True))
+        # 等文件系统操作完成，关闭线程池。
+        cls._fs_pool.shutdown()
+        # 关闭共享会话，释放连接池。
+        if cls._session is not None and not cls._session.closed:
+            cls.__loop.run_until_complete(cls._session.close())
         # 退出异步循环。
         cls.__loop.close()
 
@@ -493,7 +1766,7 @@ class Pixiv:
         """
         # 必须只能传1个参数。
         if len(args) == 1:
-            cls.__search_by_id(args[0])
+            cls.__run('id', args, cls.__search_by_id(args[0]))
         # 不是1个参数，就报错。
         else:
             cls.__error('[错误] 指令不对哦!要不再看一眼help?')
@@ -506,7 +1779,7 @@ class Pixiv:
         """
         # 必须有2个参数，id、数量：
         if len(args) == 2:
-            cls.__search_by_member(args[0], args[1])
+            cls.__run('member', args, cls.__search_by_member(args[0], args[1]))
         # 不是2个参数，就报错。
         else:
             cls.__error('[错误] 指令不对哦!要不再看一眼help?')
@@ -519,19 +1792,39 @@ class Pixiv:
         """
         # 如果没给参数，就按默认的来。
         if len(args) == 0:
-            cls.__search_by_rank()
+            cls.__run('rank', args, cls.__search_by_rank())
         # 如果有1个参数：
         elif len(args) == 1:
             arg = args[0]
-            # 如果它是数字，说明是数量。
-            if re.fullmatch('\d+', arg):
-                cls.__search_by_rank(quantity=arg)
+            # 如果它是数字或 "all"，说明是数量。
+            if re.fullmatch(r'\d+|all', arg):
+                cls.__run('rank', args, cls.__search_by_rank(quantity=arg))
             # 如果它不是数字，说明是模式。
             else:
-                cls.__search_by_rank(mode=arg)
+                cls.__run('rank', args, cls.__search_by_rank(mode=arg))
         # 如果有2个参数，它们分别就是模式和数量。
         elif len(args) == 2:
-            cls.__search_by_rank(mode=args[0], quantity=args[1])
+            cls.__run('rank', args, cls.__search_by_rank(
+                mode=args[0], quantity=args[1]))
+        else:
+            cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+
+    @classmethod
+    def parse_command_archive(cls, args: list):
+        """解析归档排行榜的指令。
+
+        :param args: 指令参数列表。
+        """
+        # 至少要有起始日期和结束日期。
+        if len(args) >= 2:
+            start, end, *modes = args
+            # 最后1个是数字或 "all" 的话，说明是数量。
+            quantity = '30'
+            if len(modes) != 0 and re.fullmatch(r'\d+|all', modes[-1]):
+                quantity = modes.pop()
+            # 没给模式就归档日榜。
+            cls.__run('archive', args, cls.__search_by_archive(
+                start, end, modes or ['day'], quantity))
         else:
             cls.__error('[错误] 指令不对哦!要不再看一眼help?')
 
@@ -539,23 +1832,105 @@ class Pixiv:
     def parse_command_tag(cls, args: list):
         """解析按标签搜索的指令。
 
+        带有"--local"时，只在本地保存的元数据里搜索。
+
         :param args: 指令参数列表。
         """
+        name = 'tag'
+        search = cls.__search_by_tag
+        if '--local' in args:
+            args = [arg for arg in args if arg != '--local']
+            name = 'tag --local'
+            search = cls.__search_by_local_tag
         # 参数至少需要2个：
         if len(args) >= 2:
             # 挑出最后2个检查，前面的全都看作标签。
             *tags, last_1, last_2 = args
-            # 如果全是数字，说明一个是数量，一个是人气。
-            if re.fullmatch('\d+', f'{last_1}{last_2}'):
-                cls.__search_by_tag(tags, last_1, popularity=int(last_2))
+            # 如果都是数字（数量也可以是 "all"），说明一个是数量，一个是人气。
+            if re.fullmatch(r'\d+|all', last_1) and re.fullmatch(r'\d+', last_2):
+                cls.__run(name, args, search(tags, last_1, popularity=int(last_2)))
             # 如果不全是数字，说明未指定人气，可推出倒数第2个也是标签，最后1个是数量。
             else:
                 tags.append(last_1)
-                cls.__search_by_tag(tags, last_2)
+                cls.__run(name, args, search(tags, last_2))
         # 如果不足2个，就报错。
         else:
             cls.__error('[错误] 指令不对哦!要不再看一眼help?')
 
+    @classmethod
+    def parse_command_follow(cls, args: list):
+        """解析关注画师并同步新作品的指令。
+
+        :param args: 指令参数列表。
+        """
+        cls.__run('follow', args, cls.__follow(args))
+
+    @classmethod
+    def parse_command_promote(cls, args: list):
+        """解析把插画换成原图的指令。
+
+        :param args: 指令参数列表。
+        """
+        # 至少要有1个插画 ID。
+        if len(args) >= 1:
+            cls.__run('promote', args, cls.__search_by_ids(args), tier='original')
+        else:
+            cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+
+    @classmethod
+    def parse_command_query(cls, args: list):
+        """解析查询本地插画元数据的指令。
+
+        不请求网络，只在搜索过的插画里查找，按收藏数从高到低列出。
+
+        :param args: 指令参数列表。
+        """
+        # 挑出画师选项。
+        members = [arg[len('member='):] for arg in args if arg.startswith('member=')]
+        tags = [arg for arg in args if not arg.startswith('member=')]
+        member_id = members[-1] if len(members) != 0 else None
+        if member_id is not None and re.fullmatch(r'\d{1,10}', member_id) is None:
+            cls.__error('[错误] ID不合法哦!')
+            return
+        # 除了标签还有别的参数时，最后1个是数字的话就是人气。
+        popularity = 0
+        if len(tags) + len(members) >= 2 and re.fullmatch(r'\d+', tags[-1] if tags else ''):
+            popularity = int(tags.pop())
+        if len(tags) == 0 and member_id is None:
+            cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+            return
+        total = cls._metadata.count(tags, popularity, member_id)
+        if total == 0:
+            cls.__warning('[提示] 本地没有符合条件的插画，先用 tag、member 等指令搜索一下吧。')
+            return
+        for illust in cls._metadata.query(tags, popularity, member_id, cls.query_limit):
+            # 原图已经下载过的，标上"✓"。
+            mark = '✓' if cls._index.lookup(illust['id'], 0) is not None else ' '
+            print(f'{mark} [{illust["id"]}] {illust["title"]} - '
+                  f'{illust["user"]["name"]} ({illust["total_bookmarks"]}收藏)')
+        cls.__prompt(f'共找到{total}幅插画' +
+                     (f'，只显示了前{cls.query_limit}幅' if total > cls.query_limit else ''))
+
+    @classmethod
+    def parse_command_cache(cls, args: list):
+        """解析查看或清空 API 缓存的指令。
+
+        :param args: 指令参数列表。
+        """
+        # 没有参数就显示统计数据。
+        if len(args) == 0:
+            stats = cls._cache.stats
+            total = stats['hits'] + stats['misses']
+            rate = stats['hits'] / total * 100 if total else 0
+            cls.__prompt(f'缓存命中: {stats["hits"]}次, 未命中: {stats["misses"]}次, 命中率: {rate:.1f}%')
+            cls.__prompt(f'缓存记录: {stats["entries"]}条, 共{stats["size"] / 1024:.1f}KB')
+        # "clear" 清空缓存。
+        elif args == ['clear']:
+            cls._cache.clear()
+            cls.__prompt('缓存已清空!')
+        else:
+            cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+
     @classmethod
     def parse_command_help(cls, args: list):
         """解析帮助的指令。
@@ -569,23 +1944,141 @@ class Pixiv:
         else:
             cls.__error('[错误] 指令不对哦!要不再看一眼help?')
 
+    @classmethod
+    def __dispatch(cls, command: list):
+        """执行一条指令。
+
+        指令里任意位置的"size=尺寸"指定这条指令下载的图片尺寸，不算作参数。
+
+        :param command: 拆分好的指令，第一项是功能名，其余是参数。
+        """
+        if len(command) == 0:
+            return
+        elif command[0] in cls.functions:
+            # 挑出尺寸选项。
+            sizes = [arg for arg in command[1:] if arg.startswith('size=')]
+            args = [arg for arg in command[1:] if not arg.startswith('size=')]
+            if len(sizes) != 0:
+                tier = sizes[-1][len('size='):]
+                if tier not in cls.size_tiers:
+                    cls.__error(f'[错误] 尺寸不合法哦! 可选: {", ".join(cls.size_tiers)}')
+                    return
+                cls._tier = tier
+            try:
+                getattr(cls, f'parse_command_{command[0]}')(args)
+            finally:
+                cls._tier = None
+        else:
+            cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+
     @classmethod
     def run_on_terminal(cls):
         """在终端运行程序。"""
-        while True:
-            command = input('>>> ').split()
-            if len(command) == 0:
-                continue
-            elif command[0] == 'quit':
-                break
-            elif command[0] in cls.functions:
-                eval(f'cls.parse_command_{command[0]}(command[1:])')
-            else:
-                cls.__error('[错误] 指令不对哦!要不再看一眼help?')
+        try:
+            while True:
+                command = input('>>> ').split()
+                if command[:1] == ['quit']:
+                    break
+                cls.__dispatch(command)
+        finally:
+            cls.__quit()
 
-        cls.__quit()
+    @classmethod
+    def run_batch(cls, commands: list[list]):
+        """不经交互，并发执行一批指令。
+
+        每条指令都是一个任务，所有任务同时进行，共用同一个异步循环、连接池、调度器、缓存和去重集合，
+        一个任务等待 API 时，别的任务可以继续下载。全部完成后退出。
+
+        :param commands: 指令列表，每条指令都是拆分好的字符串列表。
+        """
+        cls._batch = []
+        try:
+            for command in commands:
+                if command[:1] == ['quit']:
+                    break
+                cls.__prompt(f'>>> {" ".join(command)}')
+                cls.__dispatch(command)
+            tasks, cls._batch = cls._batch, None
+            if len(tasks) != 0:
+                cls.__loop.run_until_complete(asyncio.gather(*tasks))
+        finally:
+            cls.__quit()
+
+
+def read_jobs(path: str) -> list[list]:
+    """读取任务文件。
+
+    每行一条指令，格式与终端里输入的相同；空行和以"#"开头的行会被忽略。
+
+    :param path: 任务文件路径。
+
+    :returns: 指令列表，每条指令都是拆分好的字符串列表。
+    """
+    with open(path, encoding='utf-8') as fr:
+        lines = [line.split() for line in fr]
+    return [line for line in lines if len(line) != 0 and not line[0].startswith('#')]
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数。"""
+    parser = argparse.ArgumentParser(
+        description='通过 pixivel.moe 下载 Pixiv 插画。不给指令时进入交互模式。')
+    parser.add_argument('--jobs', action='append', default=[], metavar='FILE',
+                        help='任务文件，每行一条指令，可以指定多次')
+    parser.add_argument('--output-dir', metavar='DIR',
+                        help=f'输出目录，默认为 "{Pixiv.output_dir}"；指定时临时文件放在它下面的 ".temp" 里')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='导出每条指令的性能统计，扩展名为 .prom 时为 Prometheus 文本格式，否则为 JSON 行')
+    parser.add_argument('--concurrency', type=int, metavar='N',
+                        help='固定同时下载的图片数，不再根据网络状况自动调整')
+    parser.add_argument('--max-bandwidth', type=int, metavar='KB',
+                        help='所有下载加起来的带宽上限（KB/秒），默认不限')
+    parser.add_argument('--api-mirror', action='append', default=[], metavar='URL',
+                        help='API 的备用地址，可以指定多次')
+    parser.add_argument('--image-mirror', action='append', default=[], metavar='URL',
+                        help=f'图片代理的备用地址，可以指定多次，默认只用 {Pixiv.image_mirrors[0]}')
+    parser.add_argument('--no-hedge', action='store_true',
+                        help='有备用地址时，不向另一个地址发出对冲请求')
+    parser.add_argument('--api-rate', type=float, metavar='N',
+                        help=f'每秒最多向 API 发起的请求数，默认为{Pixiv.api_rate}')
+    parser.add_argument('--ugoira', choices=Ugoira.formats,
+                        help='把动图合成为 GIF 或 WebP，需要安装 Pillow；不指定时只解压出各帧')
+    parser.add_argument('--size', choices=Pixiv.size_tiers,
+                        help=f'指令没有指定尺寸时下载的图片尺寸，默认为 "{Pixiv.default_tier}"')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='一条指令，例如: rank week 100')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    if args.output_dir is not None:
+        Pixiv.output_dir = args.output_dir
+        # 临时文件要原子地重命名进输出目录，必须在同一文件系统上，所以放在输出目录下面。
+        Pixiv.temp_dir = os.path.join(args.output_dir, '.temp')
+    if args.size is not None:
+        Pixiv.default_tier = args.size
+    if args.ugoira is not None:
+        Pixiv.ugoira_format = args.ugoira
+    if args.api_rate is not None:
+        Pixiv.api_rate = args.api_rate
+    if args.metrics is not None:
+        Pixiv.metrics_path = args.metrics
+    if args.concurrency is not None:
+        Pixiv.concurrency = args.concurrency
+        Pixiv.adaptive_concurrency = False
+    if args.max_bandwidth is not None:
+        Pixiv.max_bandwidth = args.max_bandwidth * 1024
+    Pixiv.api_mirrors = args.api_mirror
+    Pixiv.image_mirrors = [*Pixiv.image_mirrors, *args.image_mirror]
+    if args.no_hedge:
+        Pixiv.hedge_requests = False
+    commands = [command for path in args.jobs for command in read_jobs(path)]
+    if len(args.command) != 0:
+        commands.append(args.command)
     app = Pixiv()
-    app.run_on_terminal()
+    if len(commands) != 0:
+        app.run_batch(commands)
+    else:
+        app.run_on_terminal()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import aiohttp
+
+
+class HTTPStatusError(Exception):
+    """响应状态码不符合预期。"""
+
+    def __init__(self, url: str, status: int, retry_after: str = None):
+        """记录失败的请求。
+
+        :param url: 请求链接。
+        :param status: 响应状态码。
+        :param retry_after: 响应的 Retry-After 头，没有则为 None。
+        """
+        super().__init__(f'对 {url} 的请求失败了! 状态码: {status}')
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    """请求失败时的重试策略。
+
+    只重试暂时性的错误（限流、服务器错误、连接中断、超时），
+    等待时间按指数增长并加随机抖动，服务器给了 Retry-After 就照它等。
+    每个任务有一份重试预算，用完后不再重试，避免在服务器故障时无休止地等下去。
+    """
+    # 值得重试的状态码。
+    retry_statuses = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5,
+                 max_delay: float = 30, budget: int = 100):
+        """初始化重试策略。
+
+        :param max_attempts: 单次请求最多尝试的次数（含第一次）。
+        :param base_delay: 第一次重试前的基准等待时间（秒）。
+        :param max_delay: 单次等待时间的上限（秒）。
+        :param budget: 一个任务里所有请求加起来最多重试的次数。
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        # 本任务已经用掉的重试次数。
+        self.retries = 0
+
+    def is_retryable(self, e: BaseException) -> bool:
+        """判断一个错误是否值得重试。
+
+        :param e: 请求过程中抛出的异常。
+
+        :returns: 暂时性错误为 True，其他（如404、磁盘错误）为 False。
+        """
+        if isinstance(e, HTTPStatusError):
+            return e.status in self.retry_statuses
+        return isinstance(e, (aiohttp.ClientConnectionError,
+                              aiohttp.ClientPayloadError,
+                              asyncio.TimeoutError))
+
+    @staticmethod
+    def parse_retry_after(value: str) -> float:
+        """解析 Retry-After 头。
+
+        :param value: 秒数或 HTTP 日期。
+
+        :returns: 需要等待的秒数，无法解析则返回 None。
+        """
+        if value is None:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+    def get_delay(self, attempt: int, e: BaseException) -> float:
+        """计算第几次重试前要等多久。
+
+        :param attempt: 已经失败的次数，从1开始。
+        :param e: 上一次失败的异常。
+
+        :returns: 等待秒数。
+        """
+        retry_after = self.parse_retry_after(getattr(e, 'retry_after', None))
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # 指数退避，在[0, 上限]之间均匀抖动，避免大家同时重试。
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, func: Callable[..., Awaitable], *args):
+        """调用协程函数，遇到暂时性错误时退避重试。
+
+        :param func: 协程函数。
+        :param args: 传给协程函数的参数。
+
+        :returns: 协程函数的返回值。重试用尽时抛出最后一次的异常。
+        """
+        attempt = 0
+        while True:
+            try:
+                return await func(*args)
+            except Exception as e:
+                attempt += 1
+                if (not self.is_retryable(e) or attempt >= self.max_attempts
+                        or self.retries >= self.budget):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.get_delay(attempt, e))
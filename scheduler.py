@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Awaitable, Callable, Hashable
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """令牌桶限速器。"""
+
+    def __init__(self, rate: float, capacity: int):
+        """初始化令牌桶。
+
+        :param rate: 每秒补充的令牌数。
+        :param capacity: 桶的容量，即允许的突发请求数。
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def __refill(self):
+        """按流逝的时间补充令牌。"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """取走一枚令牌，桶空时等待补充。"""
+        while True:
+            self.__refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def consume(self, amount: float):
+        """取走若干令牌，不够时先欠着，再等到还清为止。
+
+        用于按字节数限制带宽：收到一块数据后取走与字节数相同的令牌，一块再大也不会卡住。
+
+        :param amount: 令牌数。
+        """
+        self.__refill()
+        self._tokens -= amount
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class AdaptiveLimit:
+    """AIMD 式的自适应并发上限。
+
+    每隔一段时间，按这段时间里观察到的吞吐量、首字节延迟和过载错误（限流、服务器错误、超时等）调整一次上限：
+    出现过载错误就减半；首字节延迟明显高于基线，说明请求在代理那里排队，按比例收缩；
+    上次加大后吞吐量反而下降，就退回一步；否则上限确实被用满时加1。
+    上下限相等时不做调整。
+    """
+    # 出现过载错误时上限乘的系数。
+    backoff = 0.5
+    # 延迟过高时上限乘的系数。
+    shrink = 0.8
+    # 延迟至少比基线高出多少秒才算过高，免得本地或局域网里毫秒级的抖动也让上限收缩。
+    margin = 0.05
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None,
+                 interval: float = 1, tolerance: float = 2):
+        """初始化并发上限。
+
+        :param initial: 初始上限。
+        :param minimum: 上限的最小值。
+        :param maximum: 上限的最大值，为 None 时等于初始上限，即不做调整。
+        :param interval: 调整的间隔（秒）。
+        :param tolerance: 首字节延迟超过基线的几倍时收缩。
+        """
+        self.minimum = minimum
+        self.maximum = maximum if maximum is not None else initial
+        self.limit = min(max(initial, minimum), self.maximum)
+        self.interval = interval
+        self.tolerance = tolerance
+        # 正在占用的名额数。
+        self.active = 0
+        self._waiters = deque()
+        # 首字节延迟的基线，取观察到的较低值。
+        self._baseline = None
+        # 上一段时间的吞吐量（字节/秒）。
+        self._throughput = None
+        # 上一次调整是否加大了上限。
+        self._increased = False
+        self.__reset()
+
+    def __reset(self):
+        """开始新一段观察。"""
+        self._started = time.monotonic()
+        self._bytes = 0
+        self._latency = 0.0
+        self._samples = 0
+        self._congested = 0
+        self._saturated = self.active >= self.limit
+
+    def __wake(self):
+        """有空余名额时唤醒等待者，让它们重新检查。"""
+        vacancy = self.limit - self.active
+        while self._waiters and vacancy > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                vacancy -= 1
+
+    async def acquire(self):
+        """占用一个名额，名额用满时等待。"""
+        while self.active >= self.limit:
+            self._saturated = True
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 被取消时把唤醒机会让给下一个等待者。
+                if waiter.done() and not waiter.cancelled():
+                    self.__wake()
+                raise
+        self.active += 1
+        if self.active >= self.limit:
+            self._saturated = True
+
+    def release(self):
+        """归还一个名额。"""
+        self.active -= 1
+        self.__wake()
+
+    def observe(self, latency: float, size: int, congested: bool):
+        """记录一次请求的结果，时间到了就调整上限。
+
+        :param latency: 首字节延迟（秒），没收到响应时为 None。
+        :param size: 收到的字节数。
+        :param congested: 是否是过载错误。
+        """
+        self._bytes += size
+        if latency is not None:
+            self._latency += latency
+            self._samples += 1
+        if congested:
+            self._congested += 1
+        if time.monotonic() - self._started >= self.interval:
+            self.__adjust()
+
+    def __adjust(self):
+        """按这段时间的观察调整上限。"""
+        if self.minimum == self.maximum:
+            self.__reset()
+            return
+        elapsed = time.monotonic() - self._started
+        throughput = self._bytes / elapsed
+        latency = self._latency / self._samples if self._samples else None
+        limit = self.limit
+        if self._congested:
+            limit = int(limit * self.backoff)
+        elif (latency is not None and self._baseline is not None
+              and latency > max(self._baseline * self.tolerance, self._baseline + self.margin)):
+            limit = int(limit * self.shrink)
+        elif self._increased and self._throughput is not None and throughput < self._throughput * 0.9:
+            limit -= 1
+        elif self._saturated:
+            limit += 1
+        limit = min(max(limit, self.minimum), self.maximum)
+        self._increased = limit > self.limit
+        self.limit = limit
+        # 基线跟随较低的延迟，偏高时只缓慢上移，以适应代理本身变慢。
+        if latency is not None:
+            if self._baseline is None or latency < self._baseline:
+                self._baseline = latency
+            else:
+                self._baseline += (latency - self._baseline) * 0.05
+        self._throughput = throughput
+        self.__reset()
+        self.__wake()
+
+
+class Scheduler:
+    """有界并发的下载调度器，多个任务共用。
+
+    工作协程轮流从各个任务的优先队列里取活干，所以同时进行的任务平分并发额度；
+    同时执行的活数由自适应的并发上限控制，随网络状况在上下限之间调整。
+    某个任务的队列满时，它的提交方会被阻塞（背压）。
+    每个主机的请求速率由各自的令牌桶限制。优先级数值越小越先执行。
+    """
+
+    def __init__(self, worker: Callable[..., Awaitable], concurrency: int = 8,
+                 rate: float = 20, burst: int = 10, queue_size: int = 32,
+                 min_concurrency: int = 1, max_concurrency: int = None):
+        """初始化调度器。
+
+        :param worker: 执行单个任务的协程函数，第一个参数必须是链接。
+        :param concurrency: 同时执行的任务数的初始上限。
+        :param rate: 每个主机每秒允许发起的请求数。
+        :param burst: 每个主机允许的突发请求数。
+        :param queue_size: 每个任务等待队列的长度上限。
+        :param min_concurrency: 并发上限自动调整的最小值。
+        :param max_concurrency: 并发上限自动调整的最大值，为 None 时固定为初始上限。
+        """
+        self.worker = worker
+        self.limit = AdaptiveLimit(concurrency, min_concurrency, max_concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.queue_size = queue_size
+        # 各任务执行失败的活，值为(参数元组, 异常)列表。
+        self.failures = {}
+        # 各任务的等待队列。
+        self._queues = {}
+        # 队列里有活的任务，按轮转顺序排列。
+        self._ready = deque()
+        # 所有队列里的活的总数。
+        self._pending = asyncio.Semaphore(0)
+        self._buckets = {}
+        self._workers = []
+        # 同优先级下按提交顺序执行。
+        self._counter = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        """排队中的活数。"""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def __bucket(self, url: str) -> TokenBucket:
+        """取得链接所属主机的令牌桶。
+
+        :param url: 请求链接。
+
+        :returns: 该主机的令牌桶。
+        """
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    def __next(self) -> tuple[Hashable, tuple]:
+        """轮到下一个任务，取出它优先级最高的活。
+
+        :returns: 任务和参数元组。
+        """
+        job = self._ready.popleft()
+        queue = self._queues[job]
+        _, _, args = queue.get_nowait()
+        # 还有活就排到队尾，等下一轮。
+        if not queue.empty():
+            self._ready.append(job)
+        return job, args
+
+    async def __work(self):
+        """工作协程：不断取出活并执行。"""
+        while True:
+            await self._pending.acquire()
+            await self.limit.acquire()
+            job, args = self.__next()
+            try:
+                await self.__bucket(args[0]).acquire()
+                await self.worker(*args)
+            except Exception as e:
+                self.failures[job].append((args, e))
+            finally:
+                self.limit.release()
+                self._queues[job].task_done()
+
+    def start(self):
+        """启动工作协程。已经启动过的话什么也不做。"""
+        if len(self._workers) == 0:
+            # 按上限的最大值准备工作协程，实际同时执行的数量由并发上限控制。
+            self._workers = [asyncio.ensure_future(self.__work())
+                             for _ in range(self.limit.maximum)]
+
+    def open(self, job: Hashable):
+        """为一个任务开设等待队列。
+
+        :param job: 任务标识。
+        """
+        self._queues[job] = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self.failures[job] = []
+
+    async def submit(self, job: Hashable, priority: int, *args):
+        """提交一件活，该任务的队列已满时等待。
+
+        :param job: 任务标识。
+        :param priority: 优先级，数值越小越先执行。
+        :param args: 传给工作函数的参数。
+        """
+        queue = self._queues[job]
+        await queue.put((priority, next(self._counter), args))
+        # 队列从空变为非空，重新加入轮转。
+        if job not in self._ready:
+            self._ready.append(job)
+        self._pending.release()
+
+    async def join(self, job: Hashable) -> list[tuple[tuple, Exception]]:
+        """等待一个任务的所有活完成，然后撤掉它的队列。
+
+        :param job: 任务标识。
+
+        :returns: 执行失败的活，元素为(参数元组, 异常)。
+        """
+        await self._queues[job].join()
+        del self._queues[job]
+        return self.failures.pop(job)
+
+    async def close(self):
+        """停止工作协程。"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
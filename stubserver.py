@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import random
+import re
+import zlib
+
+from aiohttp import web
+
+
+class StubServer:
+    """模拟 pixivel.moe 的本地桩服务器，用于离线性能测试。
+
+    "/pixiv" 模拟 api.pixivel.moe/pixiv 的 illust、member、member_illust、rank、search 接口，
+    "/img/..." 模拟 proxy.pixivel.moe 的图片服务（支持 Range 续传）。
+    插画数据由 ID 确定地生成，同样的请求总是得到同样的结果；
+    延迟、带宽、出错率和图片大小都可以配置，用来复现慢代理、不稳定的网络和大图等情况。
+    """
+    # 每页的插画数，与 api.pixivel.moe 相同。
+    page_quantity = 30
+    # 生成标签时的词表。
+    vocabulary = ('miku', 'landscape', 'girl', 'cat', 'original', 'fantasy', 'scenery', 'sky')
+    # 各预览尺寸在链接里的规格，以及原图是它的几倍大。
+    previews = {
+        'square_medium': ('360x360_70', 16),
+        'medium': ('540x540_70', 8),
+        'large': ('600x1200_90', 4)
+    }
+    # 流式发送图片时每块的字节数。
+    chunk_size = 16 * 1024
+
+    def __init__(self, illust_num: int = 300, latency: float = 0, bandwidth: int = 0, error_rate: float = 0,
+                 image_size: tuple[int, int] = (64 * 1024, 512 * 1024), max_pages: int = 3, seed: int = 0,
+                 ranges: bool = True):
+        """初始化桩服务器。
+
+        :param illust_num: 每个列表（画师作品、排行榜、搜索结果）里的插画数。
+        :param latency: 每个请求在响应前等待的时间（秒）。
+        :param bandwidth: 每个图片响应的带宽（字节/秒），为0时不限。
+        :param error_rate: 请求返回 503 的概率。
+        :param image_size: 原图大小（字节）的最小值和最大值，预览图按比例缩小。
+        :param max_pages: 每幅插画最多的分P数。
+        :param seed: 随机数种子。
+        :param ranges: 是否支持 Range 续传，为 False 时忽略 Range 头，总是返回完整图片。
+        """
+        self.illust_num = illust_num
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self.max_pages = max_pages
+        self.seed = seed
+        self.ranges = ranges
+        # 不存在（比如已被删除）的插画 ID，请求它们时返回 404。
+        self.missing = set()
+        # 所有图片内容都从这段随机数据里截取，开头换成 JPEG 的魔数。
+        # 由种子决定，同样种子的几个桩服务器可以互为镜像。
+        self.payload = b'\xff\xd8\xff\xe0' + random.Random(seed).randbytes(max(image_size) - 4)
+        self.base_url = None
+        self.runner = None
+
+    def __random(self, *key) -> random.Random:
+        """取得由键确定的随机数生成器，同样的键总是生成同样的数据。"""
+        return random.Random(f'{self.seed}-{key}')
+
+    def __image_url(self, illust_id: int, page: int, tier: str) -> str:
+        """构造图片链接。
+
+        与真实的 API 一样返回 i.pximg.net 的链接，由下载程序换成图片代理（桩服务器的 "/img"），
+        所以几个互为镜像的桩服务器返回的链接完全相同。
+
+        :param illust_id: 插画 ID。
+        :param page: 分P序号。
+        :param tier: 尺寸名。
+
+        :returns: 图片链接。
+        """
+        date = '2021/01/01/00/00/00'
+        if tier == 'original':
+            return f'https://i.pximg.net/img-original/img/{date}/{illust_id}_p{page}.jpg'
+        spec = self.previews[tier][0]
+        suffix = 'square1200' if tier == 'square_medium' else 'master1200'
+        return f'https://i.pximg.net/c/{spec}/img-master/img/{date}/{illust_id}_p{page}_{suffix}.jpg'
+
+    def make_illust(self, illust_id: int, member_id: int = None, tags: list[str] = ()) -> dict:
+        """生成一幅插画的数据。
+
+        :param illust_id: 插画 ID。
+        :param member_id: 画师 ID，为 None 时随机生成。
+        :param tags: 插画一定带有的标签。
+
+        :returns: 插画字典，格式与 API 返回的相同。
+        """
+        rng = self.__random('illust', illust_id)
+        page_count = rng.randint(1, self.max_pages)
+        member_id = member_id if member_id is not None else rng.randrange(1, 100000)
+        tags = list(dict.fromkeys([*tags, *rng.sample(self.vocabulary, 3)]))
+        illust = {
+            'id': illust_id,
+            'title': f'illust{illust_id}',
+            'type': 'illust',
+            'visible': True,
+            'page_count': page_count,
+            'total_bookmarks': rng.randrange(0, 10000),
+            'tags': [{'name': tag, 'translated_name': None} for tag in tags],
+            'user': {'id': member_id, 'name': f'member{member_id}'},
+            'create_date': '2021-01-01T00:00:00+09:00',
+            'image_urls': {tier: self.__image_url(illust_id, 0, tier) for tier in self.previews}
+        }
+        if page_count == 1:
+            illust['meta_single_page'] = {'original_image_url': self.__image_url(illust_id, 0, 'original')}
+            illust['meta_pages'] = []
+        else:
+            illust['meta_single_page'] = {}
+            illust['meta_pages'] = [{'image_urls': {
+                tier: self.__image_url(illust_id, page, tier) for tier in (*self.previews, 'original')
+            }} for page in range(page_count)]
+        return illust
+
+    def __list_page(self, key: str, page: int, **kwargs) -> dict:
+        """生成一个列表的某一页。
+
+        每个列表占一段互不重叠的 ID，不同的指令不会下载到同一幅插画；ID 从大到小排列，与 Pixiv 一样新作品在前。
+
+        :param key: 列表的标识，决定 ID 段。
+        :param page: 页码，从0开始。
+        :param kwargs: 传给 make_illust 的其他参数。
+
+        :returns: 响应数据。
+        """
+        base = 100000000 + zlib.crc32(key.encode()) % 10000 * 100000
+        start = page * self.page_quantity
+        end = min(start + self.page_quantity, self.illust_num)
+        return {'illusts': [self.make_illust(base + self.illust_num - 1 - index, **kwargs)
+                            for index in range(start, end)]}
+
+    async def __delay(self) -> bool:
+        """模拟网络延迟，并决定这次请求是否出错。
+
+        :returns: 这次请求是否应该返回错误。
+        """
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return random.random() < self.error_rate
+
+    async def __serve_api(self, request: web.Request) -> web.Response:
+        """模拟 api.pixivel.moe/pixiv。"""
+        if await self.__delay():
+            return web.Response(status=503, headers={'Retry-After': '0'})
+        query = request.query
+        type = query.get('type')
+        page = int(query.get('page', 0))
+        if type == 'illust':
+            if int(query['id']) in self.missing:
+                return web.json_response({'error': 'not found'}, status=404)
+            return web.json_response({'illust': self.make_illust(int(query['id']))})
+        elif type == 'member':
+            return web.json_response({'user': {'id': int(query['id']), 'name': f'member{query["id"]}'}})
+        elif type == 'member_illust':
+            return web.json_response(self.__list_page(
+                f'member-{query["id"]}', page, member_id=int(query['id'])))
+        elif type == 'rank':
+            return web.json_response(self.__list_page(
+                f'rank-{query.get("mode")}-{query.get("date")}', page))
+        elif type == 'search':
+            return web.json_response(self.__list_page(
+                f'search-{query.get("word")}', page, tags=query.get('word', '').split()))
+        return web.json_response({'error': f'unknown type: {type}'}, status=400)
+
+    async def __serve_image(self, request: web.Request) -> web.StreamResponse:
+        """模拟 proxy.pixivel.moe 的图片服务，按配置的带宽分块发送。"""
+        if await self.__delay():
+            return web.Response(status=503, headers={'Retry-After': '0'})
+        match = re.search(r'/(\d+)_p(\d+)', request.path)
+        if match is None:
+            return web.Response(status=404)
+        illust_id, page = int(match[1]), int(match[2])
+        low, high = self.image_size
+        size = self.__random('image', illust_id, page).randint(low, high)
+        for spec, ratio in self.previews.values():
+            if f'/c/{spec}/' in request.path:
+                size = max(size // ratio, 1024)
+        body = self.payload[:size]
+        headers = {'ETag': f'"{illust_id}-{page}-{size}"', 'Content-Type': 'image/jpeg'}
+        # 支持 "bytes=起点-" 形式的续传。
+        start = 0
+        match = None
+        if self.ranges:
+            headers['Accept-Ranges'] = 'bytes'
+            match = re.fullmatch(r'bytes=(\d+)-', request.headers.get('Range', ''))
+        if match is not None:
+            start = int(match[1])
+            if start >= size:
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+            headers['Content-Range'] = f'bytes {start}-{size - 1}/{size}'
+        response = web.StreamResponse(status=200 if match is None else 206, headers=headers)
+        response.content_length = size - start
+        try:
+            await response.prepare(request)
+            for offset in range(start, size, self.chunk_size):
+                chunk = body[offset:offset + self.chunk_size]
+                await response.write(chunk)
+                if self.bandwidth > 0:
+                    await asyncio.sleep(len(chunk) / self.bandwidth)
+            await response.write_eof()
+        except ConnectionResetError:
+            # 客户端中途断开，比如取消了落后的对冲请求。
+            pass
+        return response
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """启动桩服务器。
+
+        :param host: 监听地址。
+        :param port: 监听端口，为0时由系统分配。
+
+        :returns: 服务器根地址。
+        """
+        app = web.Application()
+        app.router.add_get('/pixiv', self.__serve_api)
+        app.router.add_get('/img/{tail:.*}', self.__serve_image)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    async def close(self):
+        """关闭桩服务器。"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """给命令行解析器加上桩服务器的选项，benchmark.py 共用。
+
+    :param parser: 命令行解析器。
+    """
+    parser.add_argument('--latency', type=float, default=0, metavar='MS',
+                        help='每个请求的延迟（毫秒），默认为0')
+    parser.add_argument('--bandwidth', type=int, default=0, metavar='KB',
+                        help='每个图片响应的带宽（KB/秒），默认不限')
+    parser.add_argument('--error-rate', type=float, default=0, metavar='P',
+                        help='请求返回 503 的概率，默认为0')
+    parser.add_argument('--image-size', default='64-512', metavar='KB[-KB]',
+                        help='原图大小（KB），可以是一个范围，默认为 64-512')
+    parser.add_argument('--illusts', type=int, default=300, metavar='N',
+                        help='每个列表里的插画数，默认为300')
+    parser.add_argument('--seed', type=int, default=0, metavar='N',
+                        help='随机数种子，默认为0')
+
+
+def from_arguments(args: argparse.Namespace) -> StubServer:
+    """按命令行选项创建桩服务器。
+
+    :param args: 解析好的命令行参数。
+
+    :returns: 桩服务器。
+    """
+    low, _, high = args.image_size.partition('-')
+    return StubServer(illust_num=args.illusts, latency=args.latency / 1000,
+                      bandwidth=args.bandwidth * 1024, error_rate=args.error_rate,
+                      image_size=(int(low) * 1024, int(high or low) * 1024), seed=args.seed)
+
+
+async def serve(server: StubServer, host: str, port: int):
+    """启动桩服务器，打印根地址后一直运行。"""
+    print(await server.start(host, port), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟 pixivel.moe 的本地桩服务器。')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认为 127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='监听端口，默认由系统分配')
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(from_arguments(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
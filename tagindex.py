@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+
+class TagIndex:
+    """标签的倒排索引。
+
+    每个标签对应一个按 ID 从小到大排好序的插画 ID 数组，多标签查询就是几个有序数组求交集。
+    数组用 array 紧凑存放，几十万条记录也只占几 MB 内存。
+    """
+
+    def __init__(self, postings: Iterable[tuple[str, int]], bookmarks: dict[int, int]):
+        """建立索引。
+
+        :param postings: (标签, 插画 ID) 的序列，顺序不限。
+        :param bookmarks: 插画 ID 到收藏数的字典。
+        """
+        lists = {}
+        for tag, illust_id in postings:
+            lists.setdefault(tag.lower(), set()).add(illust_id)
+        self._postings = {tag: array('q', sorted(ids)) for tag, ids in lists.items()}
+        self.bookmarks = bookmarks
+
+    @staticmethod
+    def intersect(a: array, b: array) -> array:
+        """求两个有序数组的交集。
+
+        遍历短的数组，在长的数组里二分查找，查找的起点只往后移，
+        所以两个数组长度悬殊时，代价只与短的数组成正比。
+
+        :param a: 有序数组。
+        :param b: 有序数组。
+
+        :returns: 交集，仍然有序。
+        """
+        if len(a) > len(b):
+            a, b = b, a
+        result = array('q')
+        lo = 0
+        for x in a:
+            lo = bisect_left(b, x, lo)
+            if lo == len(b):
+                break
+            if b[lo] == x:
+                result.append(x)
+        return result
+
+    @staticmethod
+    def subtract(a: array, b: array) -> array:
+        """从有序数组里去掉另一个有序数组里有的元素。
+
+        :param a: 有序数组。
+        :param b: 要去掉的元素组成的有序数组。
+
+        :returns: 差集，仍然有序。
+        """
+        result = array('q')
+        lo = 0
+        for x in a:
+            lo = bisect_left(b, x, lo)
+            if lo == len(b) or b[lo] != x:
+                result.append(x)
+        return result
+
+    def search(self, tags: list[str], popularity: int = 0, exclude: list[str] = ()) -> list[int]:
+        """查找同时带有所有标签、收藏数达标的插画。
+
+        :param tags: 插画必须同时带有的标签，不区分大小写。
+        :param popularity: 收藏数最低值。
+        :param exclude: 插画不能带有的标签。
+
+        :returns: 插画 ID 列表，从新到旧排列；没给标签时为空列表。
+        """
+        if len(tags) == 0:
+            return []
+        # 从最短的数组开始求交集，中间结果越小，后面越快。
+        lists = sorted((self._postings.get(tag.lower(), array('q')) for tag in tags), key=len)
+        result = lists[0]
+        for postings in lists[1:]:
+            if len(result) == 0:
+                break
+            result = self.intersect(result, postings)
+        for tag in exclude:
+            result = self.subtract(result, self._postings.get(tag.lower(), array('q')))
+        # 插画 ID 随发布时间递增，倒过来就是从新到旧。
+        return [illust_id for illust_id in reversed(result)
+                if self.bookmarks.get(illust_id, 0) >= popularity]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import sys
+
+import pytest
+
+# 模块都在仓库根目录下。
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pixiv import Pixiv
+from stubserver import StubServer
+
+
+@pytest.fixture
+def stub_app(tmp_path, monkeypatch):
+    """在本地桩服务器上初始化好的应用。
+
+    桩服务器和应用跑在同一个异步循环里，输出、临时和缓存目录都在 tmp_path 下。
+    桩服务器的属性（延迟、出错率等）可以在测试里直接修改。
+
+    :returns: (应用的异步循环, 桩服务器) 元组。
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(Pixiv, 'output_dir', str(tmp_path / 'outputs'))
+    monkeypatch.setattr(Pixiv, 'temp_dir', str(tmp_path / 'temp'))
+    monkeypatch.setattr(Pixiv, 'cache_dir', str(tmp_path / 'cache'))
+    monkeypatch.setattr(Pixiv, 'metrics_path', None)
+    monkeypatch.setattr(Pixiv, '_session', None)
+    # 类属性里的任务状态是整个进程共用的，每个测试从头开始。
+    monkeypatch.setattr(Pixiv, '_scheduled', set())
+    monkeypatch.setattr(Pixiv, '_jobs', [])
+    server = StubServer(illust_num=30, image_size=(64 * 1024, 64 * 1024))
+    base_url = loop.run_until_complete(server.start())
+    monkeypatch.setattr(Pixiv, 'api_url', f'{base_url}/pixiv')
+    monkeypatch.setattr(Pixiv, 'api_mirrors', [])
+    monkeypatch.setattr(Pixiv, 'image_mirrors', [f'{base_url}/img'])
+    Pixiv()
+    try:
+        yield loop, server
+    finally:
+        loop.run_until_complete(server.close())
+        Pixiv._Pixiv__quit()
+        asyncio.set_event_loop(None)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+import cache
+from cache import ResponseCache
+
+
+class Clock:
+    """可以手动拨动的时钟，代替 time.time。"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+def entry_size(data: dict) -> int:
+    """一条记录按多少字节计入缓存大小。"""
+    return len(json.dumps(data, ensure_ascii=False).encode())
+
+
+def test_make_key_normalizes_params():
+    assert (ResponseCache.make_key('u', {'type': 'illust', 'id': 1})
+            == ResponseCache.make_key('u', {'id': '1', 'type': 'illust'}))
+
+
+def test_ttl(tmp_path, clock):
+    responses = ResponseCache(str(tmp_path / 'responses.db'), 1024 * 1024)
+    responses.put('a', {'value': 1}, 60)
+    responses.put('forever', {'value': 2}, None)
+    clock.now += 59
+    assert responses.get('a') == {'value': 1}
+    clock.now += 1
+    # 到期就删掉。
+    assert responses.get('a') is None
+    assert responses.stats['entries'] == 1
+    clock.now += 10 ** 9
+    assert responses.get('forever') == {'value': 2}
+    assert (responses.hits, responses.misses) == (2, 1)
+    responses.close()
+
+
+def test_lru_eviction(tmp_path, clock):
+    size = entry_size({'value': 'x' * 100})
+    responses = ResponseCache(str(tmp_path / 'responses.db'), size * 3)
+    for key in ('a', 'b', 'c'):
+        responses.put(key, {'value': 'x' * 100}, None)
+        clock.now += 1
+    # 访问过的 a 变成最近使用，超出上限时先淘汰最久没被访问的 b。
+    assert responses.get('a') is not None
+    clock.now += 1
+    responses.put('d', {'value': 'x' * 100}, None)
+    assert responses.get('b') is None
+    assert all(responses.get(key) is not None for key in ('a', 'c', 'd'))
+    assert responses.stats['size'] == size * 3
+    responses.close()
+
+
+def test_oversized_entry_not_cached(tmp_path, clock):
+    responses = ResponseCache(str(tmp_path / 'responses.db'), 10)
+    responses.put('a', {'value': 'x' * 100}, None)
+    assert responses.get('a') is None
+    assert responses.stats['size'] == 0
+    responses.close()
+
+
+def test_size_survives_reopen(tmp_path, clock):
+    path = str(tmp_path / 'responses.db')
+    responses = ResponseCache(path, 1024 * 1024)
+    responses.put('a', {'value': 1}, None)
+    responses.put('a', {'value': 22}, None)
+    responses.close()
+    # 覆盖写入不重复计算大小，重新打开时从数据库里算出同样的总大小。
+    responses = ResponseCache(path, 1024 * 1024)
+    assert responses.stats == {'hits': 0, 'misses': 0, 'entries': 1, 'size': entry_size({'value': 22})}
+    responses.close()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from job import Job
+from pixiv import Pixiv
+
+
+def run(command: str):
+    """像在交互模式里输入一样执行一条指令。"""
+    Pixiv._Pixiv__dispatch(command.split())
+
+
+def list_images() -> list[str]:
+    """列出输出目录里的图片（不含按内容存放的目录）。"""
+    return [os.path.join(root, name) for root, dirs, files in os.walk(Pixiv.output_dir)
+            if Pixiv.blob_dir not in root.split(os.sep)
+            for name in files if name.endswith('.jpg')]
+
+
+def test_id_downloads(stub_app, capsys):
+    run('id 1')
+    assert '任务出错了' not in capsys.readouterr().out
+    assert len(list_images()) == stub_app[1].make_illust(1)['page_count']
+
+
+def test_id_not_found(stub_app, capsys):
+    stub_app[1].missing.add(999)
+    run('id 999')
+    out = capsys.readouterr().out
+    assert '找不到这幅图哦!' in out
+    assert '任务出错了' not in out
+    assert list_images() == []
+
+
+def test_relink_deleted_image_in_same_session(stub_app, capsys):
+    run('id 1')
+    images = list_images()
+    assert len(images) != 0
+    for path in images:
+        os.remove(path)
+    # 同一个进程里再下载一次，按内容存放的那份还在，直接链接回来。
+    run('id 1')
+    assert '都已经下载过' in capsys.readouterr().out
+    assert all(os.path.exists(path) for path in images)
+
+
+def test_failed_search_closes_job(stub_app):
+    loop, server = stub_app
+    job = Job('failing', Pixiv._retry)
+
+    async def batches():
+        yield [server.make_illust(1)]
+        raise RuntimeError('search failed')
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(Pixiv._Pixiv__schedule(batches(), job))
+    # 出错前交出去的图片照常下载完，任务的队列和失败记录都从调度器里撤掉。
+    assert len(list_images()) == server.make_illust(1)['page_count']
+    assert job not in Pixiv._scheduler._queues
+    assert job not in Pixiv._scheduler.failures
+    assert job not in Pixiv._jobs
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+from mirrors import MirrorPool
+from retry import HTTPStatusError, RetryPolicy
+from stubserver import StubServer
+
+is_fault = RetryPolicy().is_retryable
+
+
+async def call_with_stubs(servers: list[StubServer], test):
+    """启动几个互为镜像的桩服务器，用它们的 API 地址组成地址池，交给测试函数。
+
+    :param servers: 桩服务器，第一个是链接原本指向的地址。
+    :param test: 协程函数，参数为地址池和请求函数。
+    """
+    urls = [f'{await server.start()}/pixiv' for server in servers]
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def request(url: str) -> dict:
+                async with session.get(url, params={'type': 'illust', 'id': 1}) as response:
+                    if response.status != 200:
+                        raise HTTPStatusError(url, response.status)
+                    return await response.json()
+            await test(MirrorPool(urls), request)
+    finally:
+        for server in servers:
+            await server.close()
+
+
+def warm_up(pool: MirrorPool, fast: float, slow: float):
+    """给地址池攒够延迟样本：第一个地址的延迟是 fast，占了几乎所有样本；其余地址的延迟是 slow。"""
+    for endpoint in pool.endpoints[1:]:
+        pool.succeed(endpoint, slow)
+    for _ in range(pool.min_samples):
+        pool.succeed(pool.endpoints[0], fast)
+
+
+def test_failover_to_mirror():
+    async def test(pool, request):
+        # 链接指向主地址，但主地址总是 503，立即换到镜像，不抛出异常。
+        # 两个地址一开始被选中的机会相同，多请求几次，主地址几乎一定会被选中过。
+        for _ in range(20):
+            data = await pool.call(pool.primary, request, is_fault)
+            assert data['illust']['id'] == 1
+        primary, mirror = pool.endpoints
+        assert not primary.healthy
+        assert primary.failures == 1
+        assert mirror.healthy and mirror.latency is not None
+    asyncio.run(call_with_stubs([StubServer(error_rate=1), StubServer()], test))
+
+
+def test_all_endpoints_down():
+    async def test(pool, request):
+        with pytest.raises(HTTPStatusError) as info:
+            await pool.call(pool.primary, request, is_fault)
+        assert info.value.status == 503
+        assert all(endpoint.failures == 1 for endpoint in pool.endpoints)
+    asyncio.run(call_with_stubs([StubServer(error_rate=1), StubServer(error_rate=1)], test))
+
+
+def test_no_failover_on_client_error():
+    async def test(pool, request):
+        # 404 不是地址的问题，直接抛出，不换地址，也不暂停使用。
+        with pytest.raises(HTTPStatusError) as info:
+            await pool.call(pool.primary.replace('/pixiv', '/missing'), request, is_fault)
+        assert info.value.status == 404
+    asyncio.run(call_with_stubs([StubServer(), StubServer()], test))
+
+    async def test_mirrored(pool, request):
+        async def not_found(url: str):
+            raise HTTPStatusError(url, 404)
+        with pytest.raises(HTTPStatusError):
+            await pool.call(pool.primary, not_found, is_fault)
+        assert len([endpoint for endpoint in pool.endpoints if endpoint.latency is None]) == 2
+        assert all(endpoint.healthy and endpoint.failures == 0 for endpoint in pool.endpoints)
+    asyncio.run(call_with_stubs([StubServer(), StubServer()], test_mirrored))
+
+
+def test_hedge_slow_endpoint():
+    async def test(pool, request):
+        # 主地址的历史延迟很低，几乎一定先选它；它这次卡住了，过了 p95 就向镜像对冲。
+        warm_up(pool, 0.01, 1.0)
+        start = time.monotonic()
+        data = await pool.call(pool.primary, request, is_fault)
+        assert data['illust']['id'] == 1
+        assert time.monotonic() - start < 0.5
+        assert pool.hedged == 1
+    asyncio.run(call_with_stubs([StubServer(latency=1), StubServer()], test))
+
+
+def test_no_hedge_before_enough_samples():
+    async def test(pool, request):
+        pool.succeed(pool.endpoints[0], 0.01)
+        pool.succeed(pool.endpoints[1], 1.0)
+        await pool.call(pool.primary, request, is_fault)
+        assert pool.hedged == 0
+    asyncio.run(call_with_stubs([StubServer(latency=0.2), StubServer()], test))
+
+
+def test_prefers_faster_endpoint():
+    pool = MirrorPool(['http://a', 'http://b'])
+    warm_up(pool, 0.01, 0.1)
+    chosen = [pool.choose().url for _ in range(1000)]
+    # 慢10倍的地址只分到约1%的请求。
+    assert chosen.count('http://b') < 50
+
+
+def test_single_endpoint_passes_through():
+    async def test():
+        pool = MirrorPool(['http://a'])
+
+        async def request(url: str):
+            raise HTTPStatusError(url, 503)
+        with pytest.raises(HTTPStatusError):
+            await pool.call('http://a/x', request, is_fault)
+        # 只有一个地址时不记录任何状态。
+        assert pool.endpoints[0].failures == 0
+    asyncio.run(test())
+
+
+def test_health_check_restores_endpoint():
+    async def test():
+        pool = MirrorPool(['http://a', 'http://b'])
+        pool.fail(pool.endpoints[0])
+        pool.fail(pool.endpoints[1])
+        assert not pool.endpoints[0].healthy
+
+        async def probe(url: str) -> bool:
+            return url == 'http://a'
+        await pool.check(probe)
+        assert pool.endpoints[0].healthy and pool.endpoints[0].failures == 0
+        # 还是不能用的地址暂停得更久。
+        assert not pool.endpoints[1].healthy and pool.endpoints[1].failures == 2
+    asyncio.run(test())
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+from metrics import Metrics
+from pixiv import Pixiv
+
+# 桩服务器上一张单P原图的路径，大小由 stub_app 固定为 64KB。
+IMAGE_PATH = '/img-original/img/2021/01/01/00/00/00/1_p0.jpg'
+SIZE = 64 * 1024
+
+
+def fetch(stub_app, offset: int, length: int = SIZE, etag: str = None) -> tuple[bytes, Metrics]:
+    """留下一份已经下载了 offset 字节的临时文件和日志记录，再下载同一张图片。
+
+    :param stub_app: 同名 fixture 的值。
+    :param offset: 临时文件里已有的字节数，为0时不留临时文件。
+    :param length: 日志里记录的完整长度。
+    :param etag: 日志里记录的 ETag。
+
+    :returns: 下载好的文件内容和这次下载的性能统计。
+    """
+    loop, server = stub_app
+    url = Pixiv._image_pool.primary + IMAGE_PATH
+    temppath = Pixiv._Pixiv__get_temp_path(url)
+    if offset > 0:
+        with open(temppath, 'wb') as fw:
+            fw.write(server.payload[:offset])
+        Pixiv._journal.record(url, length, etag)
+    metrics = Metrics()
+    filepath = os.path.join(Pixiv.output_dir, 'image.jpg')
+    path, size, hash = loop.run_until_complete(Pixiv._Pixiv__fetch_image(url, filepath, metrics))
+    with open(path, 'rb') as fr:
+        content = fr.read()
+    assert size == len(content)
+    assert hash == hashlib.sha256(content).hexdigest()
+    # 下载完成后临时文件和日志记录都要清掉。
+    assert Pixiv._journal.get(url) is None
+    assert not os.path.exists(temppath)
+    return content, metrics
+
+
+def test_resume_with_range(stub_app):
+    content, metrics = fetch(stub_app, 1000)
+    assert content == stub_app[1].payload[:SIZE]
+    # 只收了断点之后的部分。
+    assert metrics.requests['image']['bytes'] == SIZE - 1000
+
+
+def test_resume_with_if_range(stub_app):
+    content, metrics = fetch(stub_app, 1000, etag=f'"1-0-{SIZE}"')
+    assert content == stub_app[1].payload[:SIZE]
+    assert metrics.requests['image']['bytes'] == SIZE - 1000
+
+
+def test_refetch_when_length_changed(stub_app):
+    # 日志里的长度和服务器上的对不上，说明文件变了，不能接在旧的部分后面。
+    content, metrics = fetch(stub_app, 1000, length=SIZE + 1)
+    assert content == stub_app[1].payload[:SIZE]
+    assert metrics.requests['image']['count'] == 2
+    assert metrics.requests['image']['bytes'] == SIZE
+
+
+def test_finished_part_gets_416(stub_app):
+    # 上次其实已经下完了，服务器返回 416，不用再收数据。
+    content, metrics = fetch(stub_app, SIZE)
+    assert content == stub_app[1].payload[:SIZE]
+    assert metrics.requests['image']['bytes'] == 0
+
+
+def test_range_ignored(stub_app):
+    stub_app[1].ranges = False
+    # 服务器不支持 Range，返回完整图片，临时文件要从头写。
+    content, metrics = fetch(stub_app, 1000)
+    assert content == stub_app[1].payload[:SIZE]
+    assert metrics.requests['image']['bytes'] == SIZE
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from scheduler import AdaptiveLimit
+
+
+def observe(limit: AdaptiveLimit, latency: float = 0.01, size: int = 1024, congested: bool = False):
+    """过了调整间隔后记录一次请求，让上限按它调整一次。"""
+    time.sleep(limit.interval)
+    limit.observe(latency, size, congested)
+
+
+def saturate(limit: AdaptiveLimit):
+    """占满所有名额再全部归还，让这段观察算作上限被用满。"""
+    async def fill():
+        for _ in range(limit.limit):
+            await limit.acquire()
+        for _ in range(limit.active):
+            limit.release()
+    asyncio.run(fill())
+
+
+def test_backoff_on_congestion():
+    limit = AdaptiveLimit(8, minimum=1, maximum=16, interval=0.001)
+    observe(limit, congested=True)
+    assert limit.limit == 4
+    observe(limit, congested=True)
+    assert limit.limit == 2
+    observe(limit, congested=True)
+    observe(limit, congested=True)
+    # 不会低于下限。
+    assert limit.limit == 1
+
+
+def test_grow_when_saturated():
+    limit = AdaptiveLimit(4, minimum=1, maximum=6, interval=0.001)
+    for step, expected in enumerate((5, 6, 6)):
+        saturate(limit)
+        # 吞吐量一直在涨，不会因为加大后变慢而退回。
+        observe(limit, size=1024 * 1024 * 10 ** step)
+        # 每次只加1，不超过上限。
+        assert limit.limit == expected
+
+
+def test_hold_when_not_saturated():
+    limit = AdaptiveLimit(4, minimum=1, maximum=16, interval=0.001)
+    observe(limit)
+    observe(limit)
+    assert limit.limit == 4
+
+
+def test_shrink_on_latency():
+    limit = AdaptiveLimit(10, minimum=1, maximum=16, interval=0.001)
+    observe(limit, latency=0.1)
+    assert limit.limit == 10
+    # 首字节延迟超过基线的 tolerance 倍，说明请求在排队。
+    observe(limit, latency=0.5)
+    assert limit.limit == 8
+
+
+def test_ignore_jitter_below_margin():
+    limit = AdaptiveLimit(10, minimum=1, maximum=16, interval=0.001)
+    observe(limit, latency=0.001)
+    # 翻了几倍，但只多了几毫秒，不算排队。
+    observe(limit, latency=0.005)
+    assert limit.limit == 10
+
+
+def test_fixed_limit():
+    # 上下限相等时（--concurrency）不做调整。
+    limit = AdaptiveLimit(8, minimum=8, maximum=8, interval=0.001)
+    observe(limit, congested=True)
+    saturate(limit)
+    observe(limit)
+    assert limit.limit == 8
+
+
+def test_acquire_waits_for_release():
+    async def run():
+        limit = AdaptiveLimit(2)
+        await limit.acquire()
+        await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        limit.release()
+        await asyncio.wait_for(waiter, 1)
+        assert limit.active == 2
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+from tagindex import TagIndex
+
+
+def make_index() -> TagIndex:
+    postings = [
+        ('miku', 1), ('miku', 2), ('miku', 3), ('miku', 5), ('miku', 8),
+        ('Landscape', 2), ('landscape', 3), ('landscape', 8), ('landscape', 9),
+        ('sky', 3), ('sky', 8), ('sky', 10),
+        ('R-18', 8)
+    ]
+    bookmarks = {1: 10, 2: 200, 3: 50, 5: 0, 8: 1000, 9: 5, 10: 7}
+    return TagIndex(postings, bookmarks)
+
+
+def test_intersect():
+    a = array('q', [1, 3, 5, 7, 9])
+    b = array('q', [2, 3, 4, 9, 10, 11])
+    assert list(TagIndex.intersect(a, b)) == [3, 9]
+    assert list(TagIndex.intersect(b, a)) == [3, 9]
+    assert list(TagIndex.intersect(a, array('q'))) == []
+
+
+def test_subtract():
+    a = array('q', [1, 3, 5, 7, 9])
+    assert list(TagIndex.subtract(a, array('q', [3, 4, 9]))) == [1, 5, 7]
+    assert list(TagIndex.subtract(a, array('q'))) == list(a)
+
+
+def test_search_intersects_tags():
+    index = make_index()
+    # 新的在前，标签不区分大小写。
+    assert index.search(['miku']) == [8, 5, 3, 2, 1]
+    assert index.search(['MIKU', 'landscape']) == [8, 3, 2]
+    assert index.search(['miku', 'landscape', 'sky']) == [8, 3]
+    assert index.search(['miku', 'unknown']) == []
+
+
+def test_search_popularity_and_exclude():
+    index = make_index()
+    assert index.search(['miku', 'landscape'], popularity=100) == [8, 2]
+    assert index.search(['miku', 'landscape'], exclude=['R-18']) == [3, 2]
+
+
+def test_search_without_tags():
+    assert make_index().search([]) == []
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import zipfile
+
+# Pillow 是可选的，没有安装时只解压帧，不合成动图。
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class Ugoira:
+    """处理动图（ugoira）。
+
+    Pixiv 的动图以一个装着各帧图片的 zip 包发布，每帧的停留时间另外由 API 给出。
+    这里把 zip 包逐帧解压成普通图片，并可以借助 Pillow 合成 GIF 或 WebP 动图。
+    这些函数都是同步的，由调用方放到线程池或进程池里执行，不阻塞下载。
+    """
+    # 可以合成的动图格式。
+    formats = ('gif', 'webp')
+    # 记录各帧文件名和停留时间的文件名，位于帧目录下。
+    frames_file = 'frames.json'
+
+    @staticmethod
+    def can_assemble() -> bool:
+        """是否能合成动图，即是否安装了 Pillow。"""
+        return Image is not None
+
+    @classmethod
+    def extract(cls, zippath: str, target_dir: str, frames: list[dict], chunk_size: int = 64 * 1024) -> list[str]:
+        """把 zip 包逐帧解压到帧目录，并保存各帧的停留时间。
+
+        逐个成员分块复制，内存占用只与块大小有关，不会把整个 zip 包读进内存。
+
+        :param zippath: zip 包路径。
+        :param target_dir: 帧目录。
+        :param frames: API 给出的帧列表，元素为含 "file" 和 "delay" 的字典。
+        :param chunk_size: 复制时每块的字节数。
+
+        :returns: 按播放顺序排列的帧图片路径列表。
+        """
+        os.makedirs(target_dir, exist_ok=True)
+        framepaths = []
+        with zipfile.ZipFile(zippath) as archive:
+            for frame in frames:
+                # 只取文件名，防止 zip 包里的路径跳出帧目录。
+                framepath = os.path.join(target_dir, os.path.basename(frame['file']))
+                with archive.open(frame['file']) as fr, open(framepath, 'wb') as fw:
+                    shutil.copyfileobj(fr, fw, chunk_size)
+                framepaths.append(framepath)
+        with open(os.path.join(target_dir, cls.frames_file), 'w', encoding='utf-8') as fw:
+            json.dump(frames, fw)
+        return framepaths
+
+    @staticmethod
+    def assemble(framepaths: list[str], delays: list[int], outpath: str):
+        """把各帧合成为动图。
+
+        在进程池里执行，编码再慢也不会阻塞下载的事件循环。
+        各帧按需逐张打开，不会同时全部读进内存。
+
+        :param framepaths: 按播放顺序排列的帧图片路径列表。
+        :param delays: 每帧的停留时间（毫秒）。
+        :param outpath: 动图路径，格式由扩展名决定。
+        """
+        temppath = f'{outpath}.tmp'
+        fmt = os.path.splitext(outpath)[1][1:].upper()
+        with Image.open(framepaths[0]) as first:
+            first.save(temppath, format=fmt, save_all=True,
+                       append_images=(Image.open(path) for path in framepaths[1:]),
+                       duration=delays, loop=0)
+        os.replace(temppath, outpath)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+
+class Watchlist:
+    """关注的画师列表。
+
+    记录每位关注的画师已经看过的最大插画 ID（水位线），以 JSON 格式保存在磁盘上。
+    插画 ID 随发布时间递增，所以比水位线大的就是新作品。
+    """
+
+    def __init__(self, path: str):
+        """读取关注列表。
+
+        :param path: 关注列表文件路径。
+        """
+        self.path = path
+        self._members = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as fr:
+                    self._members = json.load(fr)
+            # 文件损坏时当作空列表。
+            except (ValueError, OSError):
+                self._members = {}
+
+    def __dump(self):
+        """把关注列表原子地写回磁盘。"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temppath = f'{self.path}.tmp'
+        with open(temppath, 'w', encoding='utf-8') as fw:
+            json.dump(self._members, fw, ensure_ascii=False, indent=2)
+        os.replace(temppath, self.path)
+
+    @property
+    def members(self) -> list[str]:
+        """关注的所有画师 ID，按关注顺序排列。"""
+        return list(self._members)
+
+    def get(self, member_id: str) -> int:
+        """查询画师的水位线。
+
+        :param member_id: 画师 ID。
+
+        :returns: 已经看过的最大插画 ID；还没同步过则返回 None。
+        """
+        return self._members.get(member_id)
+
+    def add(self, member_id: str):
+        """关注一位画师。已经关注过的话什么也不做。
+
+        :param member_id: 画师 ID。
+        """
+        if member_id not in self._members:
+            self._members[member_id] = None
+            self.__dump()
+
+    def update(self, member_id: str, watermark: int):
+        """更新画师的水位线。
+
+        :param member_id: 画师 ID。
+        :param watermark: 已经看过的最大插画 ID。
+        """
+        if self._members.get(member_id) != watermark:
+            self._members[member_id] = watermark
+            self.__dump()